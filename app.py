@@ -1,12 +1,21 @@
 import streamlit as st
 import pandas as pd
 import os
+import math
+import hashlib
+import time
 import plotly.express as px
+from contextlib import ExitStack
 
 # 匯入你原本的模組
-import getYTComments
-import classify_comments
-import cluster_comments
+import artifacts
+import job_runner
+import perf_trace
+import comment_store
+import search_index
+import similarity_index
+import thread_index
+import rollups
 from gemini_API import analyze_comments_all
 
 # 設定網頁標題與圖示
@@ -16,70 +25,153 @@ st.title("📊 YouTube 留言 AI 分析助手")
 st.markdown("輸入影片 ID，自動抓取留言、分類情緒、聚類話題，並與 AI 對話！")
 
 # 初始化 session state
-if 'selected_indices' not in st.session_state:
-    st.session_state.selected_indices = []
+# 以 comment_id 記錄選取狀態，篩選或換頁後仍能保留
+if 'selected_ids' not in st.session_state:
+    st.session_state.selected_ids = set()
+# 程式直接改寫選取集合（全選、取消全選、新結果）時加一，讓表格捨棄手動勾選的暫存狀態
+if 'selection_epoch' not in st.session_state:
+    st.session_state.selection_epoch = 0
 if 'ai_response' not in st.session_state:
     st.session_state.ai_response = None
 
+# 以下快取都以 manifest 中的產出檔版本為鍵，並透過 artifacts.resolve 讀取同一份快照的版本檔，
+# 背景 worker 在畫面繪製途中寫入新結果也不會混用新舊檔案
+APP_LOCK_TIMEOUT = 2    # 畫面端等待影片鎖的秒數，worker 正在處理時不阻塞顯示
+
+def build_index(module, video_id, df):
+    """
+    持有影片鎖時才寫回索引檔；worker 正在處理同一支影片時只在記憶體更新
+    """
+    with ExitStack() as stack:
+        try:
+            stack.enter_context(artifacts.video_lock(video_id, timeout=APP_LOCK_TIMEOUT))
+        except TimeoutError:
+            return module.build_or_update(video_id, df, save=False)
+        return module.build_or_update(video_id, df)
+
+# 搜尋索引在 CSV 更新前共用；CSV 有新留言時只增量索引新的部分
+# text 外存時只在建立索引這一次取出全部文字
+@st.cache_resource(show_spinner="正在建立搜尋索引...", max_entries=4)
+def load_search_index(video_id, csv_version, _df, _text_store):
+    columns = [c for c in ['comment_id', 'text', comment_store.TEXT_POSITION] if c in _df.columns]
+    return build_index(search_index, video_id, comment_store.with_text(_df[columns], _text_store))
+
+# 討論串索引：CSV 更新後只重算有變動的討論串
+@st.cache_resource(show_spinner="正在整理討論串...", max_entries=4)
+def load_thread_index(video_id, csv_version, _df):
+    return build_index(thread_index, video_id, _df)
+
+# 時間彙總表很小，依版本檔快取
+@st.cache_data(max_entries=16)
+def load_rollup_table(video_id, granularity, rollup_file):
+    return rollups.load_table(video_id, granularity, path=rollup_file)
+
+# 語意向量索引以 memmap 載入，索引版本變動時才重新讀取
+@st.cache_resource(max_entries=4)
+def load_similarity_index(video_id, index_version, _manifest):
+    return similarity_index.NearestNeighborIndex.load(video_id, _manifest)
+
+@st.cache_resource(show_spinner="正在載入語意模型...")
+def load_embedding_model(model_name):
+    import cluster_comments
+    return cluster_comments.get_model(model_name)
+
 # --- 側邊欄：輸入區 ---
 with st.sidebar:
     st.header("設定")
     video_id = st.text_input("YouTube 影片 ID", placeholder="例如：dQw4w9WgXcQ")
+    fetch_profile = st.selectbox(
+        "抓取模式",
+        ["full", "lean", "pulse"],
+        format_func={
+            "full": "完整（所有留言與回應）",
+            "lean": "精簡傳輸（相同資料，較省流量）",
+            "pulse": "快速風向（前 500 串熱門頂層留言）",
+        }.get,
+        help="精簡與快速模式使用 partial response 只取需要的欄位；快速模式不抓回應"
+    )
+    force_rerun = st.checkbox("強制重新計算", help="忽略快取，即使留言沒有變動也重新分類與聚類")
     process_btn = st.button("開始抓取與分析", type="primary")
 
 # --- 主要內容區 ---
 if video_id:
-    csv_file = f"comments_{video_id}.csv"
+    # 舊版放在工作目錄的產出檔搬進 artifacts/；worker 正在處理時由 worker 搬移
+    try:
+        artifacts.migrate_legacy(video_id, lock_timeout=APP_LOCK_TIMEOUT)
+    except TimeoutError:
+        pass
 
     if process_btn:
-        with st.status("正在處理中...", expanded=True) as status:
-            try:
-                st.write("1. 正在從 YouTube 抓取留言...")
-                rows = getYTComments.get_all_comments(video_id)
-                saved_filename = getYTComments.save_to_csv(video_id, rows)
-                
-                # 確保 saved_filename 不是 None
-                if saved_filename and saved_filename != csv_file:
-                    csv_file = saved_filename
-                    st.warning(f"⚠️ 原檔案被占用，已儲存為：{saved_filename}")
-                elif saved_filename:
-                    csv_file = saved_filename
-                
-                st.write("2. 正在進行情緒分類與問題辨識...")
-                classify_comments.main(video_id)
-                
-                st.write("3. 正在進行語意聚類 (這可能需要一點時間)...")
-                cluster_comments.main(video_id)
-                
-                status.update(label="全部處理完成！", state="complete", expanded=False)
-                st.success(f"已成功分析 {len(rows)} 則留言！")
-                
-                # 重置選擇
-                st.session_state.selected_indices = []
-                
-            except PermissionError as e:
-                status.update(label="發生錯誤！", state="error", expanded=True)
-                st.error(str(e))
-                st.info("💡 **快速解決方法：**\n\n"
-                       "1. 關閉所有 Excel 視窗（包括 comments_*.csv 和 cluster_keywords.csv）\n\n"
-                       "2. 或直接刪除以下檔案：\n"
-                       f"   - comments_{video_id}.csv\n"
-                       "   - cluster_keywords.csv\n\n"
-                       "3. 然後重新點擊「開始抓取與分析」\n\n"
-                       "💡 **提示：** cluster_keywords.csv 會在分析時自動重新生成，刪除是安全的！")
-            except Exception as e:
-                status.update(label="發生錯誤！", state="error", expanded=True)
-                st.error(f"發生錯誤：{str(e)}")
-                st.info("請檢查影片 ID 是否正確，或稍後再試。")
+        # 交給背景 worker 執行；同一支影片已在處理中時會沿用既有工作
+        job_runner.submit_job(video_id, force=force_rerun, fetch_profile=fetch_profile)
+    
+    # 輪詢時一併處理 worker 中斷的工作（重新排隊或標記失敗）
+    job = job_runner.poll_job(video_id)
+    
+    if job and job["status"] in job_runner.ACTIVE_STATES:
+        stage_labels = {
+            "fetch": "1. 從 YouTube 抓取留言",
+            "classify": "2. 情緒分類與問題辨識",
+            "cluster": "3. 語意聚類 (這可能需要一點時間)",
+            "rollup": "4. 時間趨勢彙總",
+        }
+        stage_icons = {"pending": "⏳", "running": "🔄", "done": "✅", "error": "❌"}
+        stages = job["stages"]
+        done_count = sum(1 for s in stages.values() if s["state"] == "done")
+        
+        with st.status("正在背景處理中...", expanded=True):
+            st.progress(done_count / len(stages), text=f"已完成 {done_count} / {len(stages)} 個階段")
+            for stage, info in stages.items():
+                st.write(f"{stage_icons.get(info['state'], '⏳')} {stage_labels.get(stage, stage)}")
+            st.caption("分析在背景執行，重新整理頁面不會中斷；完成後會自動顯示結果。")
+        
+        # 定時重新整理以更新進度
+        time.sleep(job_runner.POLL_SECONDS)
+        st.rerun()
+    
+    elif job and job["status"] == "error":
+        st.error(f"發生錯誤：{job['error']}")
+        if job.get("error_type") == "PermissionError":
+            st.info("💡 **快速解決方法：**\n\n"
+                   f"1. 關閉所有開啟 {artifacts.video_dir(video_id)} 內檔案的 Excel 視窗"
+                   "（comments.csv、cluster_keywords.csv）\n\n"
+                   "2. 然後重新點擊「開始抓取與分析」\n\n"
+                   "💡 **提示：** 寫入失敗時原檔案不會被改動，也不會另存成其他檔名。")
+        else:
+            st.info("請檢查影片 ID 是否正確，或稍後再試。")
+    
+    elif job and job["status"] == "done":
+        result = job.get("result", {})
+        
+        # 新結果第一次出現時重置選擇
+        if st.session_state.get("finished_job") != (video_id, job["finished_at"]):
+            st.session_state.finished_job = (video_id, job["finished_at"])
+            st.session_state.selected_ids = set()
+            st.session_state.selection_epoch += 1
+            st.success(f"已成功分析 {result.get('rows', 0)} 則留言！")
+            reused = [stage for stage, state in result.get("report", {}).items() if state == "reused"]
+            if reused:
+                st.caption(f"♻️ 留言與參數未變動，沿用快取結果的階段：{', '.join(reused)}")
+            stats = result.get("fetch_stats")
+            if stats:
+                st.caption(
+                    f"📡 抓取模式 {stats['profile']}：{sum(stats['requests'].values())} 次請求、"
+                    f"{stats['quota_units']} 配額單位、{stats['bytes'] / 1024:.1f} KB"
+                )
+
+    # 這次畫面使用的產出檔版本
+    manifest = artifacts.snapshot(video_id)
+    csv_version = artifacts.version_of(manifest, "comments.csv")
+    csv_file = artifacts.resolve(video_id, manifest, "comments.csv")
 
     # 如果檔案存在，顯示分析結果
-    if os.path.exists(csv_file):
-        df = pd.read_csv(csv_file)
-        
-        # 將 cluster 欄位轉換為整數（移除小數點）
-        if 'cluster' in df.columns:
-            df['cluster'] = df['cluster'].fillna(-1).astype(int)
-            df.loc[df['cluster'] == -1, 'cluster'] = pd.NA
+    if csv_file and os.path.exists(csv_file):
+        # 精簡型別載入：類別欄位、窄整數、datetime 時間（cluster 為可含空值的整數）
+        # 大型影片的 text 不放進 DataFrame，顯示前再以 with_text 從 memmap 取出需要的列
+        if os.path.getsize(csv_file) > comment_store.OFFLOAD_TEXT_MB * 1024 * 1024:
+            df, text_store = comment_store.load_comments_offloaded(csv_file)
+        else:
+            df, text_store = comment_store.load_comments(csv_file), None
         
         # === 第一排：數據指標 ===
         col1, col2, col3 = st.columns(3)
@@ -100,22 +192,75 @@ if video_id:
         with c2:
             st.subheader("話題聚類分佈")
             if "cluster" in df.columns:
-                fig_cluster = px.histogram(df, x='cluster', color='cluster')
+                clustered_df = df.dropna(subset=['cluster']).astype({'cluster': int})
+                fig_cluster = px.histogram(clustered_df, x='cluster', color='cluster')
                 st.plotly_chart(fig_cluster, use_container_width=True)
 
+        # === 情緒與話題趨勢（讀取預先彙總的時間桶，不掃描原始留言） ===
+        rollup_file = artifacts.resolve(video_id, manifest, os.path.basename(rollups.rollup_path(video_id)))
+        if rollup_file is not None:
+            st.divider()
+            st.subheader("📈 情緒與話題趨勢")
+            
+            granularity_options = {'每小時': 'hour', '每日': 'day', '每週': 'week'}
+            col_trend1, col_trend2 = st.columns(2)
+            with col_trend1:
+                granularity_label = st.selectbox("時間粒度", options=list(granularity_options.keys()), index=1, key="trend_granularity")
+            with col_trend2:
+                time_axis = st.selectbox("時間軸", options=['實際時間', '距第一則留言'], key="trend_axis")
+            
+            granularity = granularity_options[granularity_label]
+            trend = load_rollup_table(video_id, granularity, rollup_file)
+            
+            if trend is not None and len(trend) > 0:
+                if time_axis == '距第一則留言':
+                    unit_hours = {'hour': 1, 'day': 24, 'week': 24 * 7}[granularity]
+                    unit_label = {'hour': '小時', 'day': '天', 'week': '週'}[granularity]
+                    elapsed = (trend['bucket'] - trend['bucket'].min()) / pd.Timedelta(hours=unit_hours)
+                    trend = trend.assign(x=elapsed.astype(int))
+                    x_label = f"距第一則留言（{unit_label}）"
+                else:
+                    trend = trend.assign(x=trend['bucket'])
+                    x_label = "時間 (UTC)"
+                
+                c_trend1, c_trend2 = st.columns(2)
+                with c_trend1:
+                    sentiment_trend = trend.groupby(['x', 'sentiment'], observed=True, as_index=False)['count'].sum()
+                    fig_sent_trend = px.area(
+                        sentiment_trend, x='x', y='count', color='sentiment',
+                        color_discrete_map={'positive': 'green', 'neutral': 'gray', 'negative': 'red'},
+                        labels={'x': x_label, 'count': '留言數'}, title="情緒變化"
+                    )
+                    st.plotly_chart(fig_sent_trend, use_container_width=True)
+                with c_trend2:
+                    topic_trend = trend[trend['cluster'] >= 0].groupby(['x', 'cluster'], as_index=False)['count'].sum()
+                    if len(topic_trend) > 0:
+                        topic_trend['cluster'] = topic_trend['cluster'].astype(str)
+                        fig_topic_trend = px.line(
+                            topic_trend, x='x', y='count', color='cluster',
+                            labels={'x': x_label, 'count': '留言數', 'cluster': '聚類'}, title="話題變化"
+                        )
+                        st.plotly_chart(fig_topic_trend, use_container_width=True)
+                
+                question_trend = trend[trend['is_question']].groupby('x', as_index=False)['count'].sum()
+                if len(question_trend) > 0:
+                    fig_question_trend = px.bar(
+                        question_trend, x='x', y='count',
+                        labels={'x': x_label, 'count': '問題數'}, title="問題留言數"
+                    )
+                    st.plotly_chart(fig_question_trend, use_container_width=True)
+
         # === 第三排：話題聚類總覽 ===
         if "cluster" in df.columns:
             st.divider()
             st.subheader("🏷️ 話題聚類總覽")
             
-            # 讀取 cluster_keywords.csv
-            cluster_keywords_file = "cluster_keywords.csv"
+            # 讀取這支影片自己的 cluster_keywords.csv
+            cluster_keywords_file = artifacts.resolve(video_id, manifest, "cluster_keywords.csv")
             
-            if os.path.exists(cluster_keywords_file):
+            if cluster_keywords_file and os.path.exists(cluster_keywords_file):
                 try:
                     kw_df = pd.read_csv(cluster_keywords_file)
-                    # 只取當前 video_id 的關鍵字
-                    kw_df = kw_df[kw_df['video_id'] == video_id]
                     
                     if len(kw_df) > 0:
                         # 使用卡片式呈現
@@ -148,10 +293,62 @@ if video_id:
             else:
                 st.info("聚類關鍵字檔案不存在，請先完成分析")
 
+        # === 熱門討論串 ===
+        def format_time(value):
+            # 發佈時間缺值（NaT）的討論串無法格式化
+            return f"{value:%Y-%m-%d %H:%M}" if pd.notna(value) else "時間不明"
+        
+        st.divider()
+        st.subheader("🔥 熱門討論串")
+        threads = load_thread_index(video_id, csv_version, df)
+        
+        thread_sort_options = {
+            '回覆數': 'reply_count',
+            '總按讚數': 'total_likes',
+            '負面留言數': 'negative',
+            '問題數': 'question_count',
+            '最後活動時間': 'last_activity',
+        }
+        col_thread1, col_thread2 = st.columns(2)
+        with col_thread1:
+            thread_sort = st.selectbox("排序依據", options=list(thread_sort_options.keys()), key="thread_sort")
+        with col_thread2:
+            thread_top_n = st.selectbox("顯示串數", options=[10, 20, 50], key="thread_top_n")
+        
+        hot = threads.hot_threads(sort_by=thread_sort_options[thread_sort], top_n=thread_top_n)
+        hot_members = {tid: threads.members(tid) for tid in hot.index}
+        member_ids = [cid for ids in hot_members.values() for cid in ids]
+        member_df = comment_store.with_text(
+            df[df['comment_id'].isin(member_ids)].drop_duplicates('comment_id'), text_store
+        ).set_index('comment_id')
+        
+        for tid, row in hot.iterrows():
+            ids = [cid for cid in hot_members[tid] if cid in member_df.index]
+            if not ids:
+                continue
+            root = member_df.loc[ids[0]]
+            title = (
+                f"💬 {int(row['reply_count'])} 則回覆 ・ 👍 {int(row['total_likes'])} ・ "
+                f"🟢 {int(row['positive'])} ⚪ {int(row['neutral'])} 🔴 {int(row['negative'])} ・ "
+                f"❓ {int(row['question_count'])} ｜ {str(root['text'])[:40]}"
+            )
+            with st.expander(title):
+                st.caption(f"最早 {format_time(row['first_activity'])} ・ 最後活動 {format_time(row['last_activity'])}")
+                for cid in ids:
+                    comment = member_df.loc[cid]
+                    indent = "　　↳ " if comment['is_reply'] else ""
+                    st.markdown(f"{indent}**{comment['author']}**（👍 {int(comment['likeCount'])}）：{comment['text']}")
+
         # === 第四排：篩選選項 ===
         st.divider()
         st.subheader("🔍 篩選評論")
         
+        search_query = st.text_input(
+            "🔎 關鍵字搜尋",
+            placeholder="例如：電池 續航 OR 充電（空白 = 且，OR 或 | = 或）",
+            key="search_query"
+        )
+        
         col_filter1, col_filter2, col_filter3 = st.columns(3)
         
         with col_filter1:
@@ -183,7 +380,7 @@ if video_id:
                 cluster_filter = '全部'
         
         # 應用篩選
-        filtered_df = df.copy()
+        filtered_df = df
         
         # 情緒篩選
         if sentiment_filter:
@@ -199,6 +396,14 @@ if video_id:
         if cluster_filter != '全部' and "cluster" in df.columns:
             filtered_df = filtered_df[filtered_df['cluster'] == cluster_filter]
         
+        # 關鍵字搜尋（倒排索引）
+        if search_query.strip():
+            index = load_search_index(video_id, csv_version, df, text_store)
+            search_start = time.perf_counter()
+            matched_ids = index.search(search_query)
+            filtered_df = filtered_df[filtered_df['comment_id'].isin(matched_ids)]
+            st.caption(f"搜尋「{search_query}」命中 {len(matched_ids)} 則，耗時 {(time.perf_counter() - search_start) * 1000:.1f} ms")
+        
         # 重置索引以便後續使用
         filtered_df = filtered_df.reset_index(drop=True)
         
@@ -208,19 +413,55 @@ if video_id:
         st.divider()
         st.subheader("📝 選擇要分析的留言")
         
-        # 全選/取消全選按鈕
+        # 全選/取消全選按鈕（全選涵蓋整個篩選結果，而非只有目前頁面）
         col_select1, col_select2, col_select3 = st.columns([1, 1, 8])
         with col_select1:
             if st.button("全選"):
-                st.session_state.selected_indices = list(range(len(filtered_df)))
+                st.session_state.selected_ids = set(filtered_df['comment_id'])
+                st.session_state.selection_epoch += 1
                 st.rerun()
         with col_select2:
             if st.button("取消全選"):
-                st.session_state.selected_indices = []
+                st.session_state.selected_ids = set()
+                st.session_state.selection_epoch += 1
                 st.rerun()
         
-        # 準備顯示用的資料框
-        display_df = filtered_df.copy()
+        # 排序與分頁設定
+        sort_options = {'預設': None, '按讚數': 'likeCount', '發布時間': 'publishedAt'}
+        col_page1, col_page2, col_page3, col_page4 = st.columns(4)
+        with col_page1:
+            sort_label = st.selectbox("排序依據", options=list(sort_options.keys()), key="sort_by")
+        with col_page2:
+            sort_order = st.selectbox("排序方向", options=['由大到小', '由小到大'], key="sort_order")
+        with col_page3:
+            page_size = st.selectbox("每頁筆數", options=[25, 50, 100, 200, 500], index=2, key="page_size")
+        
+        # 先排序整個篩選結果，再切出目前頁面
+        sort_col = sort_options[sort_label]
+        if sort_col and sort_col in filtered_df.columns:
+            filtered_df = filtered_df.sort_values(
+                sort_col,
+                ascending=(sort_order == '由小到大'),
+                kind="mergesort"
+            ).reset_index(drop=True)
+        
+        total_pages = max(1, math.ceil(len(filtered_df) / page_size))
+        # 篩選條件改變後頁數可能變少，先把頁碼夾回有效範圍
+        if st.session_state.get('page', 1) > total_pages:
+            st.session_state.page = total_pages
+        with col_page4:
+            page = st.number_input("頁碼", min_value=1, max_value=total_pages, step=1, key="page")
+        
+        start = (int(page) - 1) * page_size
+        page_df = comment_store.with_text(filtered_df.iloc[start:start + page_size], text_store)
+        st.caption(f"第 {int(page)} / {total_pages} 頁（顯示第 {start + 1 if len(page_df) else 0} ~ {start + len(page_df)} 則）")
+        
+        # 準備顯示用的資料框（只處理目前頁面）
+        display_df = page_df.copy()
+        
+        # 類別欄位轉回字串，交給 data_editor 當一般文字顯示
+        for col in ['author', 'sentiment']:
+            display_df[col] = display_df[col].astype(str)
         
         # 加入情緒和問題的視覺化標記
         def format_sentiment(row):
@@ -231,20 +472,18 @@ if video_id:
         
         display_df.insert(0, '標記', display_df.apply(format_sentiment, axis=1))
         
-        # 加入選擇欄位
-        display_df.insert(0, '選擇', False)
-        
-        # 設置已選中的項目
-        if st.session_state.selected_indices:
-            for idx in st.session_state.selected_indices:
-                if idx < len(display_df):
-                    display_df.at[idx, '選擇'] = True
+        # 加入選擇欄位：依 comment_id 比對已選集合
+        display_df.insert(0, '選擇', display_df['comment_id'].isin(st.session_state.selected_ids))
         
         # 選擇要顯示的欄位
-        display_columns = ['選擇', '標記', 'author', 'text', 'sentiment', 'likeCount', 'publishedAt']
+        display_columns = ['選擇', '標記', 'comment_id', 'author', 'text', 'sentiment', 'likeCount', 'publishedAt']
         if 'cluster' in display_df.columns:
             display_columns.append('cluster')
         
+        # 表格的編輯狀態依列位置保存：以本頁的 comment_id 組成 key，
+        # 篩選、排序或換頁使本頁留言不同時換成新的表格，勾選不會留在錯的留言上
+        page_key = hashlib.sha1("\x1e".join(page_df['comment_id'].astype(str)).encode("utf-8")).hexdigest()[:16]
+        
         # 使用 data_editor 讓使用者可以勾選
         edited_df = st.data_editor(
             display_df[display_columns],
@@ -253,6 +492,7 @@ if video_id:
             height=400,
             disabled=[col for col in display_columns if col != '選擇'],  # 只有選擇欄可以編輯
             column_config={
+                "comment_id": None,  # 隱藏，只用來對應選取狀態
                 "選擇": st.column_config.CheckboxColumn(
                     "選擇",
                     help="勾選要分析的留言",
@@ -279,8 +519,9 @@ if video_id:
                     "按讚數",
                     width="small"
                 ),
-                "publishedAt": st.column_config.TextColumn(
+                "publishedAt": st.column_config.DatetimeColumn(
                     "發布時間",
+                    format="YYYY-MM-DD HH:mm",
                     width="medium"
                 ),
                 "cluster": st.column_config.NumberColumn(
@@ -288,20 +529,81 @@ if video_id:
                     width="small"
                 ) if 'cluster' in display_df.columns else None
             },
-            key="comment_selector"
+            key=f"comment_selector_{page_key}_{st.session_state.selection_epoch}"
         )
         
-        # 更新選中的索引
-        new_selected = edited_df[edited_df['選擇'] == True].index.tolist()
-        if new_selected != st.session_state.selected_indices:
-            st.session_state.selected_indices = new_selected
+        # 更新選取集合：先移除本頁所有 id，再加回本頁勾選的 id
+        page_ids = set(edited_df['comment_id'])
+        checked_ids = set(edited_df.loc[edited_df['選擇'] == True, 'comment_id'])
+        st.session_state.selected_ids = (st.session_state.selected_ids - page_ids) | checked_ids
         
-        # 顯示選中數量
-        selected_count = len([x for x in edited_df['選擇'] if x])
-        st.markdown(f"**已選擇 {selected_count} 則留言**")
+        # 取得目前篩選結果中被選中的評論
+        selected_df = comment_store.with_text(
+            filtered_df[filtered_df['comment_id'].isin(st.session_state.selected_ids)], text_store
+        )
+        selected_comments = selected_df['text'].tolist()
         
-        # 獲取選中的評論文字
-        selected_comments = filtered_df.iloc[st.session_state.selected_indices]['text'].tolist() if st.session_state.selected_indices else []
+        # 顯示選中數量
+        st.markdown(f"**已選擇 {len(selected_comments)} 則留言**")
+        hidden_count = len(st.session_state.selected_ids) - len(selected_comments)
+        if hidden_count > 0:
+            st.caption(f"另有 {hidden_count} 則已選留言不在目前篩選結果中")
+
+        # === 語意搜尋與相似留言 ===
+        nn_version = artifacts.version_of(manifest, os.path.basename(similarity_index.index_path(video_id)))
+        nn_index = load_similarity_index(video_id, nn_version, manifest) if nn_version is not None else None
+        if nn_index is not None:
+            st.divider()
+            st.subheader("🧭 語意搜尋與相似留言")
+            
+            def show_similar(results, elapsed):
+                st.caption(f"耗時 {elapsed * 1000:.1f} ms（{'IVF 近似索引' if nn_index.ivf is not None else '精確搜尋'}，共 {len(nn_index)} 則向量）")
+                if not results:
+                    st.info("找不到相似的留言")
+                    return
+                text_columns = [c for c in ['text', comment_store.TEXT_POSITION] if c in df.columns]
+                result_df = pd.DataFrame(results, columns=['comment_id', '相似度']).merge(
+                    df[['comment_id', 'author', 'sentiment', 'likeCount'] + text_columns],
+                    on='comment_id', how='left'
+                )
+                result_df = comment_store.with_text(result_df, text_store)
+                result_df = result_df[['comment_id', '相似度', 'author', 'text', 'sentiment', 'likeCount']]
+                result_df['相似度'] = result_df['相似度'].round(3)
+                st.dataframe(result_df.drop(columns=['comment_id']), hide_index=True, use_container_width=True)
+            
+            top_k = st.slider("顯示筆數", min_value=5, max_value=50, value=10, key="similar_top_k")
+            tab_similar, tab_semantic = st.tabs(["找相似留言", "語意搜尋"])
+            
+            with tab_similar:
+                # 從已選留言挑選，未選擇時改用目前頁面
+                source_df = selected_df if len(selected_df) > 0 else page_df
+                source_df = source_df.head(200)
+                text_lookup = dict(zip(source_df['comment_id'], source_df['text'].astype(str)))
+                anchor_id = st.selectbox(
+                    "選擇一則留言（取自已選留言，未選擇時取自目前頁面）",
+                    options=list(text_lookup.keys()),
+                    format_func=lambda cid: text_lookup[cid][:80],
+                    key="similar_anchor"
+                )
+                if anchor_id and anchor_id not in nn_index.row_of:
+                    # 太短的留言在聚類前就被過濾（min_len），不會產生語意向量
+                    st.info("這則留言太短（或在語意索引建立後才新增），沒有語意向量可以比對相似留言")
+                elif anchor_id:
+                    search_start = time.perf_counter()
+                    results = nn_index.similar_to(anchor_id, top_k=top_k)
+                    show_similar(results, time.perf_counter() - search_start)
+            
+            with tab_semantic:
+                semantic_query = st.text_input(
+                    "描述你想找的內容",
+                    placeholder="例如：覺得音樂太大聲蓋過講話",
+                    key="semantic_query"
+                )
+                if semantic_query.strip():
+                    model = load_embedding_model(nn_index.model_name)
+                    search_start = time.perf_counter()
+                    results = nn_index.search_text(semantic_query, model, top_k=top_k)
+                    show_similar(results, time.perf_counter() - search_start)
 
         # === 第五排：AI 問答區域 ===
         st.divider()
@@ -333,7 +635,8 @@ if video_id:
             with st.spinner("Gemini 正在思考中..."):
                 # 傳入選中的評論（如果有的話）
                 selected = selected_comments if len(selected_comments) > 0 else None
-                answer = analyze_comments_all(csv_file, user_question, selected_comments=selected)
+                with perf_trace.run("gemini", video_id=video_id, comments=len(selected or [])):
+                    answer = analyze_comments_all(csv_file, user_question, selected_comments=selected)
                 st.session_state.ai_response = answer
         
         # 顯示 AI 回應
@@ -349,7 +652,7 @@ if video_id:
         col_dl1, col_dl2 = st.columns(2)
         
         with col_dl1:
-            csv_all = filtered_df.to_csv(index=False, encoding='utf-8-sig')
+            csv_all = filtered_df.to_csv(index=False, encoding='utf-8-sig', date_format=comment_store.DATE_FORMAT)
             st.download_button(
                 label="📥 下載所有篩選後的留言",
                 data=csv_all,
@@ -360,8 +663,7 @@ if video_id:
         
         with col_dl2:
             if selected_comments:
-                selected_df = filtered_df.iloc[st.session_state.selected_indices]
-                csv_selected = selected_df.to_csv(index=False, encoding='utf-8-sig')
+                csv_selected = selected_df.to_csv(index=False, encoding='utf-8-sig', date_format=comment_store.DATE_FORMAT)
                 st.download_button(
                     label="📥 下載選中的留言",
                     data=csv_selected,
@@ -376,5 +678,44 @@ if video_id:
                     use_container_width=True
                 )
 
+        # === 第七排：效能分析 ===
+        # 分析流程與 Gemini 對話的紀錄分開存放，這裡合併列出
+        trace_files = sorted(
+            perf_trace.list_traces(video_id, "pipeline") + perf_trace.list_traces(video_id, "gemini"),
+            key=os.path.getmtime, reverse=True
+        )
+        if trace_files:
+            st.divider()
+            with st.expander("⏱️ 效能分析（各階段耗時）"):
+                trace_file = st.selectbox(
+                    "執行紀錄",
+                    options=trace_files,
+                    format_func=lambda p: os.path.basename(p),
+                    key="trace_file"
+                )
+                trace = perf_trace.load_trace(trace_file)
+                
+                col_t1, col_t2, col_t3 = st.columns(3)
+                col_t1.metric("總耗時 (秒)", trace["wall_s"])
+                col_t2.metric("CPU 時間 (秒)", trace["cpu_s"])
+                col_t3.metric("最高記憶體 (MB)", trace["peak_rss_mb"] if trace["peak_rss_mb"] is not None else "-")
+                
+                if trace["counters"]:
+                    st.caption("**API 呼叫與配額：** " + "，".join(
+                        f"`{k}` = {v}" for k, v in trace["counters"].items()
+                    ))
+                
+                spans_df = pd.DataFrame(trace["spans"])
+                if len(spans_df) > 0:
+                    spans_df["步驟"] = spans_df.apply(lambda r: "　" * int(r["depth"]) + r["name"], axis=1)
+                    fig_trace = px.bar(
+                        spans_df[spans_df["depth"] <= 1],
+                        x="wall_s", y="name", orientation="h", color="parent",
+                        labels={"wall_s": "耗時 (秒)", "name": "步驟"}
+                    )
+                    st.plotly_chart(fig_trace, use_container_width=True)
+                    detail_columns = [c for c in ["步驟", "wall_s", "cpu_s", "peak_rss_mb", "rss_delta_mb", "items", "k", "silhouette"] if c in spans_df.columns]
+                    st.dataframe(spans_df[detail_columns], hide_index=True, use_container_width=True)
+
 else:
     st.info("👈 請在左側輸入影片 ID 並點擊開始分析。")
@@ -0,0 +1,385 @@
+import glob
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# ========= 1. 設定 =========
+ARTIFACTS_DIR = "artifacts"     # 每支影片一個子目錄：artifacts/<video_id>/
+MANIFEST_FILE = "manifest.json"
+
+LOCK_STALE_SECONDS = 30         # 鎖檔超過這個秒數沒有更新，視為殘留可以強制移除
+VIDEO_LOCK_TIMEOUT = 3600       # 等待同一支影片的其他執行完成的上限
+REPLACE_ATTEMPTS = 3            # 目標檔被占用（例如 Excel 開著）時的重試次數
+KEEP_VERSIONS = 3               # 每個產出檔保留的已登記版本數，讀取中的舊快照仍可使用
+
+
+def video_dir(video_id):
+    return os.path.join(ARTIFACTS_DIR, video_id)
+
+
+def path(video_id, name):
+    """
+    影片的產出檔路徑，例如 path(video_id, "comments.csv")；目錄在第一次寫入時才建立
+    """
+    return os.path.join(video_dir(video_id), name)
+
+
+# ========= 2. 檔案鎖 =========
+def _break_stale(path):
+    """
+    移除殘留的鎖檔。先取得 path + ".break" 再重新確認：若鎖檔已被換成
+    新的（inode 或時間不同），代表其他行程剛取得鎖，不能刪除
+
+    回傳:
+        True 表示鎖檔已不存在，可以立即重試
+    """
+    try:
+        stale = os.stat(path)
+    except FileNotFoundError:
+        return True
+    if time.time() - stale.st_mtime <= LOCK_STALE_SECONDS:
+        return False
+
+    break_path = path + ".break"
+    try:
+        fd = os.open(break_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        # 移除殘留鎖只需要瞬間，.break 本身過期代表上一個移除者異常結束
+        try:
+            if time.time() - os.path.getmtime(break_path) > LOCK_STALE_SECONDS:
+                os.remove(break_path)
+        except FileNotFoundError:
+            pass
+        return False
+    os.close(fd)
+    try:
+        current = os.stat(path)
+        if (current.st_ino, current.st_mtime) != (stale.st_ino, stale.st_mtime):
+            return False
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return True
+    finally:
+        os.remove(break_path)
+
+
+@contextmanager
+def file_lock(path, timeout=30, heartbeat=False):
+    """
+    以 O_EXCL 建立鎖檔的簡易跨平台檔案鎖
+
+    參數:
+        timeout: 等待鎖的秒數上限
+        heartbeat: 長時間持有時定期更新鎖檔時間，避免被其他行程當成殘留移除
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            break
+        except FileExistsError:
+            # 持有者異常結束時留下的鎖檔
+            if _break_stale(path):
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"❌ 無法取得檔案鎖：{path}")
+            time.sleep(0.05)
+
+    stop = threading.Event()
+    if heartbeat:
+        def touch():
+            while not stop.wait(LOCK_STALE_SECONDS / 3):
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    return
+        threading.Thread(target=touch, daemon=True).start()
+
+    try:
+        yield
+    finally:
+        stop.set()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def video_lock(video_id, timeout=VIDEO_LOCK_TIMEOUT):
+    """
+    同一支影片同時只允許一個執行寫入產出檔；後到的執行會等待，
+    之後透過 manifest 與階段快取沿用前一個執行的結果
+
+    參數:
+        timeout: 等待上限，逾時拋出 TimeoutError（畫面端用短的逾時，不阻塞顯示）
+    """
+    lock_path = os.path.join(video_dir(video_id), ".lock")
+    if os.path.exists(lock_path):
+        print(f"⏳ [{video_id}] 另一個執行正在處理這支影片，等待完成後沿用結果...")
+    with file_lock(lock_path, timeout=timeout, heartbeat=True):
+        yield
+
+
+# ========= 3. 原子寫入 =========
+def _replace(tmp_path, target):
+    for attempt in range(REPLACE_ATTEMPTS):
+        try:
+            os.replace(tmp_path, target)
+            return
+        except PermissionError:
+            # Windows 上目標檔被其他程式開啟時無法替換
+            if attempt < REPLACE_ATTEMPTS - 1:
+                print(f"⚠️ 檔案 {target} 被其他程式占用，2 秒後重試...")
+                time.sleep(2)
+    os.remove(tmp_path)
+    raise PermissionError(
+        f"❌ 無法儲存檔案 {target}！\n"
+        f"可能原因：檔案已被 Excel 或其他程式打開\n"
+        f"解決方法：關閉所有開啟該檔案的程式後重新執行"
+    )
+
+
+@contextmanager
+def atomic_write(target):
+    """
+    產生同目錄的暫存檔路徑給呼叫端寫入，成功後以 os.replace 替換目標檔；
+    讀取端只會看到舊檔或完整的新檔。暫存檔保留副檔名（np.save / np.savez 需要）
+    """
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    root, ext = os.path.splitext(target)
+    tmp_path = f"{root}.{os.getpid()}-{threading.get_ident()}.tmp{ext}"
+    try:
+        yield tmp_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _replace(tmp_path, target)
+
+
+def write_csv(df, target, **kwargs):
+    import comment_store
+
+    with atomic_write(target) as tmp_path:
+        df.to_csv(tmp_path, index=False, encoding="utf-8-sig", date_format=comment_store.DATE_FORMAT, **kwargs)
+    print(f"✅ 已儲存：{target}")
+    return target
+
+
+def write_json(target, data):
+    with atomic_write(target) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def read_json(target):
+    try:
+        with open(target, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# ========= 4. Manifest =========
+# 登記時把產出檔固定成不可變的版本檔（name.v<版本>.ext，以硬連結建立），
+# 寫入端之後再覆寫工作檔也不會影響已登記的版本；讀取端透過 resolve 取得快照中的版本檔
+def _manifest_path(video_id):
+    return os.path.join(video_dir(video_id), MANIFEST_FILE)
+
+
+def snapshot(video_id):
+    """
+    讀取影片的 manifest：{"version": 整體版本, "artifacts": {檔名: {"version", "file", "updated_at", ...}}}
+    讀取端以這份快照的版本號當快取鍵，並以 resolve 讀取同一組版本檔
+    """
+    return read_json(_manifest_path(video_id)) or {"video_id": video_id, "version": 0, "artifacts": {}}
+
+
+def version_of(manifest, name):
+    entry = manifest["artifacts"].get(name)
+    return entry["version"] if entry else None
+
+
+def resolve(video_id, manifest, name):
+    """
+    快照中某個產出檔的版本檔路徑；尚未登記時回傳 None
+
+    參數:
+        name: 產出檔名，例如 "comments.csv"
+    """
+    entry = manifest["artifacts"].get(name)
+    if entry is None:
+        return None
+    # 舊版 manifest 沒有版本檔，改讀工作檔
+    return path(video_id, entry.get("file", name))
+
+
+def _versions(target):
+    root, ext = os.path.splitext(target)
+    pattern = re.compile(re.escape(os.path.basename(root)) + r"\.v(\d+)" + re.escape(ext) + "$")
+    found = []
+    for candidate in glob.glob(glob.escape(root) + ".v*" + ext):
+        match = pattern.match(os.path.basename(candidate))
+        if match:
+            found.append((int(match.group(1)), candidate))
+    return [candidate for _, candidate in sorted(found)]
+
+
+def _publish(target, version):
+    root, ext = os.path.splitext(target)
+    published = f"{root}.v{version}{ext}"
+    try:
+        # 工作檔一律以 os.replace 整檔替換，硬連結指向的內容不會再改變
+        os.link(target, published)
+    except OSError:
+        shutil.copy2(target, published)
+    return os.path.basename(published)
+
+
+def _prune(target, keep=KEEP_VERSIONS):
+    for old in _versions(target)[:-keep] if keep else _versions(target):
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # Windows 上讀取端仍開著舊版本，下次登記時再刪
+            pass
+
+
+def record_many(video_id, entries):
+    """
+    一次登記多個產出檔，共用同一個新版本號；manifest 只寫一次，
+    讀取端不會看到只更新一半的組合（例如留言已有新的 cluster、關鍵字還是舊的）
+
+    參數:
+        entries: {產出檔路徑: meta dict}
+    回傳:
+        新的 manifest 版本號
+    """
+    with file_lock(_manifest_path(video_id) + ".lock"):
+        manifest = snapshot(video_id)
+        manifest["version"] += 1
+        for target, meta in entries.items():
+            name = os.path.basename(target)
+            manifest["artifacts"][name] = {
+                **manifest["artifacts"].get(name, {}),
+                "version": manifest["version"],
+                "file": _publish(target, manifest["version"]),
+                "updated_at": time.time(),
+                **meta,
+            }
+        write_json(_manifest_path(video_id), manifest)
+        for target in entries:
+            _prune(target)
+    return manifest["version"]
+
+
+def record(video_id, target, **meta):
+    """
+    產出檔寫入完成後登記到 manifest，版本號加一
+
+    參數:
+        target: 產出檔路徑（以檔名為鍵）
+        meta: 額外資訊，例如抓取模式、列數；沒有覆寫的舊資訊會保留
+    """
+    return record_many(video_id, {target: meta})
+
+
+def forget(video_id, target):
+    """
+    刪除產出檔（含已登記的版本檔）並從 manifest 移除
+    """
+    name = os.path.basename(target)
+    with file_lock(_manifest_path(video_id) + ".lock"):
+        if os.path.exists(target):
+            os.remove(target)
+        _prune(target, keep=0)
+        manifest = snapshot(video_id)
+        if manifest["artifacts"].pop(name, None) is not None:
+            manifest["version"] += 1
+            write_json(_manifest_path(video_id), manifest)
+
+
+# ========= 5. 舊版檔案搬移 =========
+# 改用 artifacts/<video_id>/ 之前，產出檔放在工作目錄並以影片 ID 為檔名後綴；
+# 討論串、搜尋索引與時間彙總會從留言重新建立，不需要搬移
+LEGACY_FILES = {
+    "comments_{}.csv": "comments.csv",
+    "tokens_{}.npz": "tokens.npz",
+    "embeddings_{}.npy": "embeddings.npy",
+    "similarity_{}.npz": "similarity.npz",
+}
+LEGACY_KEYWORDS_FILE = "cluster_keywords.csv"   # 舊版所有影片共用，以 video_id 欄位區分
+
+
+def _legacy_moves(video_id):
+    return {
+        legacy.format(video_id): path(video_id, name)
+        for legacy, name in LEGACY_FILES.items()
+        if os.path.exists(legacy.format(video_id)) and not os.path.exists(path(video_id, name))
+    }
+
+
+def _mark_legacy_checked(video_id):
+    with file_lock(_manifest_path(video_id) + ".lock"):
+        manifest = snapshot(video_id)
+        manifest["legacy_checked"] = True
+        write_json(_manifest_path(video_id), manifest)
+
+
+def migrate_legacy(video_id, lock_timeout=VIDEO_LOCK_TIMEOUT):
+    """
+    把舊版放在工作目錄的產出檔搬進 artifacts/<video_id>/ 並登記；
+    共用的 cluster_keywords.csv 只取出這支影片的列，原檔保留給其他影片。
+    檢查過一次後在 manifest 標記 legacy_checked，之後直接返回，
+    不會每次畫面重繪都等待影片鎖、重讀共用的關鍵字檔
+
+    參數:
+        lock_timeout: 等待影片鎖的上限；已在 video_lock 內呼叫時傳 None
+    回傳:
+        搬入的產出檔名列表
+    """
+    if snapshot(video_id).get("legacy_checked"):
+        return []
+    keywords_target = path(video_id, "cluster_keywords.csv")
+    has_keywords = os.path.exists(LEGACY_KEYWORDS_FILE) and not os.path.exists(keywords_target)
+    if not _legacy_moves(video_id) and not has_keywords:
+        return []
+
+    lock = video_lock(video_id, timeout=lock_timeout) if lock_timeout is not None else nullcontext()
+    with lock:
+        # 取得鎖後重新確認，其他執行可能已經搬過
+        if snapshot(video_id).get("legacy_checked"):
+            return []
+        moves = _legacy_moves(video_id)
+        for legacy, target in moves.items():
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(legacy, target)
+
+        migrated = {target: {} for target in moves.values()}
+        if os.path.exists(LEGACY_KEYWORDS_FILE) and not os.path.exists(keywords_target):
+            import pandas as pd
+
+            kw_df = pd.read_csv(LEGACY_KEYWORDS_FILE, dtype={"video_id": str})
+            if "video_id" in kw_df.columns:
+                kw_df = kw_df[kw_df["video_id"] == video_id]
+                if len(kw_df) > 0:
+                    write_csv(kw_df, keywords_target)
+                    migrated[keywords_target] = {}
+
+        if migrated:
+            # 留言與關鍵字、向量與索引一起登記
+            record_many(video_id, migrated)
+            print(f"📦 [{video_id}] 已搬移舊版產出檔：{', '.join(os.path.basename(t) for t in migrated)}")
+        _mark_legacy_checked(video_id)
+    return [os.path.basename(t) for t in migrated]
@@ -0,0 +1,403 @@
+import argparse
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+import artifacts
+import classify_comments
+import cluster_comments
+import comment_store
+import perf_trace
+import similarity_index
+
+# ========= 1. 設定 =========
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "500k": 500_000, "1m": 1_000_000}
+DEFAULT_SIZES = ["1k", "10k"]
+
+BASELINE_FILE = "benchmark_baseline.json"
+RESULTS_FILE = "benchmark_results.json"
+THRESHOLD = 0.25  # 吞吐量比 baseline 低超過 25% 或記憶體高出 25% 視為退化
+MEMORY_FLOOR_MB = 5  # 記憶體增加少於這個值時不算退化（小語料的雜訊）
+REPEATS = 3          # 短於 REPEAT_UNDER_S 的階段重複執行取最快的一次，降低計時雜訊
+REPEAT_UNDER_S = 2.0
+
+STUB_MODEL_NAME = "stub"
+BENCH_VIDEO_ID = "benchmark"
+
+# 超過這個筆數的階段預設跳過（silhouette / UMAP 是 O(n²) 或接近，1M 筆跑不完）
+STAGE_LIMITS = {
+    "find_best_k": 20_000,
+    "end_to_end": 20_000,
+}
+
+# 需要選用套件的階段；沒有安裝時略過
+STAGE_REQUIRES = {
+    "end_to_end": ["umap"],
+}
+
+# 計時前先用小語料跑一次（不計時），一次性的啟動成本不會算進第一個量測的大小：
+# UMAP 的 numba JIT 編譯約 20 秒；超過 4096 筆時 UMAP 改用 NNDescent，所以要跑過這個門檻
+WARMUP_ITEMS = {
+    "end_to_end": 5_000,
+}
+
+# 語意搜尋量測：與正式模型相同的維度，查詢取自索引內的向量
+IVF_DIM = 384
+IVF_TOPICS = 2_000      # 合成向量的主題中心數，讓向量有群聚結構（純隨機向量沒有近鄰可言）
+IVF_QUERIES = 200
+IVF_TARGET_S = 1.0      # 單次查詢的延遲目標
+
+
+# ========= 2. 合成語料 =========
+FILLERS = ["這集", "這部影片", "主持人", "剪輯", "內容", "音樂", "講解", "今天", "畫面", "節奏"]
+QUESTION_CUES = ["請問", "為什麼", "是不是", "有沒有", "怎麼辦", "能不能"]
+ENDINGS = ["", "", "！", "。", "嗎？", "呢?", "～"]
+
+
+def make_corpus(n, seed=42):
+    """
+    產生可重現的繁體中文合成留言，欄位與 getYTComments.save_to_csv 相同
+    混合 NTUSD 正負面詞、疑問詞、重複留言與回覆串
+    """
+    rng = random.Random(seed)
+    positive = sorted(classify_comments.POSITIVE_WORDS)
+    negative = sorted(classify_comments.NEGATIVE_WORDS)
+    base_time = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    rows = []
+    top_ids = []
+    texts = []
+    elapsed = 0
+
+    for i in range(n):
+        if texts and rng.random() < 0.1:
+            # 約 10% 為重複留言（洗版、複製貼上）
+            text = rng.choice(texts)
+        else:
+            words = [rng.choice(FILLERS)]
+            words += [rng.choice(positive) for _ in range(rng.randint(0, 3))]
+            words += [rng.choice(negative) for _ in range(rng.randint(0, 2))]
+            rng.shuffle(words)
+            if rng.random() < 0.2:
+                words.insert(0, rng.choice(QUESTION_CUES))
+            text = "".join(words) + rng.choice(ENDINGS)
+        texts.append(text)
+
+        comment_id = f"c{i:07d}"
+        is_reply = bool(top_ids) and rng.random() < 0.3
+        parent_id = rng.choice(top_ids[-50:]) if is_reply else comment_id
+        if not is_reply:
+            top_ids.append(comment_id)
+
+        elapsed += rng.randint(1, 120)
+        rows.append({
+            "video_id": BENCH_VIDEO_ID,
+            "comment_id": comment_id,
+            "parent_comment_id": parent_id,
+            "is_reply": is_reply,
+            "author": f"user{rng.randint(0, n // 3 + 1)}",
+            "text": text,
+            "likeCount": int(rng.expovariate(0.2)),
+            "publishedAt": (base_time + timedelta(seconds=elapsed)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        })
+
+    return pd.DataFrame(rows)
+
+
+# ========= 3. 離線替身模型 =========
+class StubEmbeddingModel:
+    """
+    以字元 bigram 雜湊成固定維度的確定性向量，介面與 SentenceTransformer.encode 相同
+    """
+
+    def __init__(self, dim=64):
+        self.dim = dim
+
+    def encode(self, sentences, batch_size=64, show_progress_bar=False, normalize_embeddings=True):
+        out = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for i, text in enumerate(sentences):
+            for a, b in zip(text, text[1:] or text):
+                out[i, zlib.crc32((a + b).encode("utf-8")) % self.dim] += 1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.where(norms == 0, 1, norms)
+        return out
+
+
+# ========= 4. 各階段 =========
+def bench_classify_text(df, workdir):
+    for text in df["text"]:
+        classify_comments.classify_text(text)
+
+
+def bench_vectorized_scoring(df, workdir):
+    texts = df["text"].tolist()
+    matrix, vocab = classify_comments.build_token_matrix([classify_comments.jieba.lcut(t) for t in texts])
+    scores = classify_comments.score_matrix(matrix, classify_comments.lexicon_weights(vocab))
+    classify_comments.sentiment_labels(scores)
+
+
+def bench_csv_roundtrip(df, workdir):
+    path = os.path.join(workdir, "roundtrip.csv")
+    df.to_csv(path, index=False, encoding="utf-8-sig")
+    pd.read_csv(path)
+
+
+def bench_embed(df, workdir):
+    cluster_comments.get_model(STUB_MODEL_NAME).encode(df["text"].tolist())
+
+
+def bench_find_best_k(df, workdir):
+    embeddings = cluster_comments.get_model(STUB_MODEL_NAME).encode(df["text"].tolist())
+    cluster_comments.find_best_k(embeddings, 2, 10)
+
+
+def bench_extract_keywords(df, workdir):
+    # 以雜湊分成 8 群，模擬聚類後的關鍵字萃取
+    df_cluster = pd.DataFrame({
+        "text": df["text"],
+        "cluster": [zlib.crc32(t.encode("utf-8")) % 8 for t in df["text"]],
+    })
+    for cid in range(8):
+        cluster_comments.extract_cluster_keywords(df_cluster, cid, top_n=10)
+
+
+def bench_end_to_end(df, workdir):
+    # 分類與聚類的主程式使用相對路徑（artifacts/<video_id>/），切到暫存目錄執行
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        artifacts.write_csv(df, comment_store.comments_path(BENCH_VIDEO_ID))
+        classify_comments.main(BENCH_VIDEO_ID)
+        cluster_comments.main(BENCH_VIDEO_ID, model_name=STUB_MODEL_NAME)
+    finally:
+        os.chdir(cwd)
+
+
+BENCHMARKS = {
+    "classify_text": bench_classify_text,
+    "vectorized_scoring": bench_vectorized_scoring,
+    "csv_roundtrip": bench_csv_roundtrip,
+    "embed": bench_embed,
+    "find_best_k": bench_find_best_k,
+    "extract_keywords": bench_extract_keywords,
+    "end_to_end": bench_end_to_end,
+}
+
+
+# ========= 5. 執行與比較 =========
+def measure_peak_mb(func, *args):
+    """
+    以 tracemalloc 量測單一階段的 Python / numpy 配置峰值 (MB)
+
+    RSS 是整個行程共用的，前一個階段留下的記憶體會算到後面的階段，
+    所以另外跑一次並只看這次呼叫期間的配置
+    """
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / (1024 * 1024), 1)
+
+
+def run_stage(stage, df):
+    """
+    每次呼叫都用新的暫存目錄，前一次留下的斷詞快取等檔案不會讓後面的量測變快
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        BENCHMARKS[stage](df, workdir)
+
+
+def run_benchmarks(sizes, stages=None, no_limits=False, seed=42, memory=True):
+    cluster_comments.set_model(STUB_MODEL_NAME, StubEmbeddingModel())
+    stages = stages or list(BENCHMARKS)
+    results = {}
+
+    with perf_trace.run("benchmark", save=False) as trace:
+        warmed = set()
+        for size_name in sizes:
+            n = SIZES[size_name]
+            with perf_trace.span("generate_corpus", items=n):
+                df = make_corpus(n, seed=seed)
+
+            for stage in stages:
+                key = f"{stage}@{size_name}"
+                limit = STAGE_LIMITS.get(stage)
+                if not no_limits and limit is not None and n > limit:
+                    print(f"⏭️ {key} 超過 {limit} 筆上限，略過（--no-limits 可強制執行）")
+                    continue
+                missing = [m for m in STAGE_REQUIRES.get(stage, []) if importlib.util.find_spec(m) is None]
+                if missing:
+                    print(f"⏭️ {key} 需要 {', '.join(missing)}，未安裝，略過")
+                    continue
+                if stage in WARMUP_ITEMS and stage not in warmed:
+                    with perf_trace.span(f"warmup.{stage}", items=WARMUP_ITEMS[stage]):
+                        run_stage(stage, make_corpus(WARMUP_ITEMS[stage], seed=seed + 1))
+                    warmed.add(stage)
+
+                # 計時與量測記憶體分開跑，tracemalloc 的額外負擔不會算進耗時
+                for attempt in range(REPEATS):
+                    with perf_trace.span(key, items=n, attempt=attempt) as current:
+                        run_stage(stage, df)
+                    if attempt == 0 or current["wall_s"] < record["wall_s"]:
+                        record = current
+                    if current["wall_s"] >= REPEAT_UNDER_S:
+                        break
+                peak_mb = measure_peak_mb(run_stage, stage, df) if memory else None
+
+                results[key] = {
+                    "items": n,
+                    "seconds": record["wall_s"],
+                    "cpu_seconds": record["cpu_s"],
+                    "items_per_s": round(n / record["wall_s"], 1) if record["wall_s"] else None,
+                    "peak_mb": peak_mb,
+                }
+                print(f"{key:<28} {record['wall_s']:>9.3f} 秒  "
+                      f"{results[key]['items_per_s'] or 0:>12.1f} 筆/秒  "
+                      f"峰值 {peak_mb if peak_mb is not None else '-'} MB")
+
+    results["_meta"] = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "seed": seed,
+        "sizes": sizes,
+        "total_wall_s": trace.to_dict()["wall_s"],
+    }
+    return results
+
+
+def compare_with_baseline(results, baseline, threshold=THRESHOLD):
+    """
+    回傳退化的項目列表：吞吐量比 baseline 低超過 threshold，
+    或記憶體峰值高出 threshold（且多於 MEMORY_FLOOR_MB）
+    """
+    regressions = []
+    for key, current in results.items():
+        if key.startswith("_") or key not in baseline:
+            continue
+
+        base_rate = baseline[key].get("items_per_s")
+        rate = current.get("items_per_s")
+        if base_rate and rate:
+            change = rate / base_rate - 1
+            status = "❌" if change < -threshold else "✅"
+            print(f"{status} {key:<28} {base_rate:>12.1f} → {rate:>12.1f} 筆/秒 ({change:+.1%})")
+            if change < -threshold:
+                regressions.append(key)
+
+        base_mb = baseline[key].get("peak_mb")
+        peak_mb = current.get("peak_mb")
+        if base_mb and peak_mb is not None:
+            grew = peak_mb > base_mb * (1 + threshold) and peak_mb - base_mb > MEMORY_FLOOR_MB
+            status = "❌" if grew else "✅"
+            print(f"{status} {key:<28} {base_mb:>12.1f} → {peak_mb:>12.1f} MB ({peak_mb / base_mb - 1:+.1%})")
+            if grew and key not in regressions:
+                regressions.append(key)
+    return regressions
+
+
+# ========= 6. 語意搜尋量測 =========
+def make_vectors(n, dim=IVF_DIM, topics=IVF_TOPICS, seed=42):
+    """
+    產生有主題群聚的正規化 float32 向量，分塊產生避免 float64 暫存佔用兩倍記憶體
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 65_536):
+        size = min(65_536, n - start)
+        block = centers[rng.integers(0, topics, size)]
+        block += 0.6 / np.sqrt(dim) * rng.standard_normal((size, dim), dtype=np.float32)
+        vectors[start:start + size] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return vectors
+
+
+def measure_similarity(n, queries=IVF_QUERIES, seed=42):
+    """
+    量測 similarity_index 在 n 筆向量上的建立時間、查詢延遲，以及 IVF 相對精確搜尋的 recall@10
+    """
+    vectors = make_vectors(n, seed=seed)
+    comment_ids = [f"c{i}" for i in range(n)]
+    exact = similarity_index.NearestNeighborIndex(vectors, comment_ids, STUB_MODEL_NAME)
+
+    start = time.perf_counter()
+    ivf = similarity_index.build_ivf(vectors, seed=seed) if n > similarity_index.EXACT_LIMIT else None
+    build_s = time.perf_counter() - start
+    index = similarity_index.NearestNeighborIndex(vectors, comment_ids, STUB_MODEL_NAME, ivf)
+
+    rows = np.random.default_rng(seed + 1).choice(n, size=queries, replace=False)
+    latencies = []
+    recalls = []
+    for row in rows:
+        start = time.perf_counter()
+        found = index.similar_to(comment_ids[row], top_k=10)
+        latencies.append(time.perf_counter() - start)
+        if ivf is not None:
+            truth = {cid for cid, _ in exact.similar_to(comment_ids[row], top_k=10)}
+            recalls.append(len(truth & {cid for cid, _ in found}) / 10)
+
+    latencies = np.array(latencies)
+    result = {
+        "items": n,
+        "mode": "ivf" if ivf is not None else "exact",
+        "lists": len(ivf[0]) if ivf is not None else None,
+        "build_s": round(build_s, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+        "recall_at_10": round(float(np.mean(recalls)), 3) if recalls else 1.0,
+    }
+    status = "✅" if result["p95_ms"] / 1000 < IVF_TARGET_S else "❌"
+    print(f"{status} similarity@{n}：{result['mode']}（{result['lists'] or '-'} 個列表），"
+          f"建立 {result['build_s']} 秒，查詢 p50 {result['p50_ms']} ms / p95 {result['p95_ms']} ms，"
+          f"recall@10 {result['recall_at_10']}")
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="留言分析流程效能基準測試（離線、使用替身向量模型）")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=DEFAULT_SIZES, help="語料大小")
+    parser.add_argument("--stages", nargs="+", choices=list(BENCHMARKS), help="只跑指定階段")
+    parser.add_argument("--no-limits", action="store_true", help="不套用大語料的階段上限")
+    parser.add_argument("--no-memory", action="store_true", help="不量測記憶體峰值（省下第二次執行）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline 檔案路徑")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="可容忍的吞吐量下降比例")
+    parser.add_argument("--update-baseline", action="store_true", help="以這次結果覆寫 baseline")
+    parser.add_argument("--similarity", choices=list(SIZES), help=f"只量測語意搜尋（{IVF_DIM} 維合成向量）")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.similarity:
+        measure_similarity(SIZES[args.similarity], seed=args.seed)
+        raise SystemExit(0)
+    results = run_benchmarks(args.sizes, args.stages, args.no_limits, args.seed, memory=not args.no_memory)
+
+    with open(RESULTS_FILE, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"✅ 已儲存：{RESULTS_FILE}")
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ 已更新 baseline：{args.baseline}")
+    else:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"❌ 效能退化：{', '.join(regressions)}")
+            raise SystemExit(1)
+        print("✅ 沒有超過門檻的效能退化")
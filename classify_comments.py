@@ -1,49 +1,36 @@
 import pandas as pd
+import numpy as np
 import jieba
-import time
+import hashlib
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+import artifacts
+import perf_trace
+import comment_store
 
 # 安全的檔案寫入函數
-def safe_write_csv(df, filename, max_attempts=3):
-    """
-    安全地寫入 CSV 檔案，如果失敗會重試
-    """
-    for attempt in range(max_attempts):
-        try:
-            # 如果不是第一次嘗試，使用不同的檔名
-            actual_filename = filename
-            if attempt > 0:
-                timestamp = int(time.time())
-                name_parts = filename.rsplit('.', 1)
-                actual_filename = f"{name_parts[0]}_{timestamp}.{name_parts[1]}"
-                print(f"⚠️ 原檔案被占用，嘗試使用新檔名：{actual_filename}")
-            
-            df.to_csv(actual_filename, index=False, encoding="utf-8-sig")
-            print(f"✅ 已儲存：{actual_filename}")
-            return actual_filename
-            
-        except PermissionError:
-            if attempt < max_attempts - 1:
-                print(f"⚠️ 檔案 {filename} 被其他程式占用，{2-attempt} 秒後重試...")
-                time.sleep(2)
-            else:
-                raise PermissionError(
-                    f"❌ 無法儲存檔案 {filename}！\n"
-                    f"可能原因：檔案已被 Excel 或其他程式打開\n"
-                    f"解決方法：關閉所有開啟該檔案的程式，或刪除舊檔案"
-                )
-        except Exception as e:
-            raise Exception(f"❌ 儲存檔案時發生錯誤：{str(e)}")
-    
-    return filename  # 如果都失敗，返回原檔名
+def safe_write_csv(df, filename):
+    """
+    先寫暫存檔再原子替換；原檔被占用時重試，不會改存成其他檔名
+    """
+    return artifacts.write_csv(df, filename)
 
 
 # ========= 1. 載入 NTUSD 詞典 =========
+# 以模組所在目錄為準：spawn 啟動的分塊行程會重新 import，不一定在專案目錄下執行
+LEXICON_DIR = os.path.dirname(os.path.abspath(__file__))
+POSITIVE_PATH = os.path.join(LEXICON_DIR, "ntusd_positive.txt")
+NEGATIVE_PATH = os.path.join(LEXICON_DIR, "ntusd_negative.txt")
+
 def load_word_set(path):
     with open(path, "r", encoding="cp950") as f:
         return set(w.strip() for w in f if w.strip())
 
-POSITIVE_WORDS = load_word_set("ntusd_positive.txt")
-NEGATIVE_WORDS = load_word_set("ntusd_negative.txt")
+POSITIVE_WORDS = load_word_set(POSITIVE_PATH)
+NEGATIVE_WORDS = load_word_set(NEGATIVE_PATH)
 
 # ========= 2. 疑問詞設定 =========
 QUESTION_WORDS = [
@@ -87,36 +74,269 @@ def is_question(text):
     return False
 
 # ========= 5. 單筆留言分類 =========
-def classify_text(text):
+def classify_text(text, pos_th=2, neg_th=-2):
     words = list(jieba.cut(text))
     score = sentiment_score(words)
 
     return {
         "sentiment_score": score,
-        "sentiment": sentiment_label(score),
+        "sentiment": sentiment_label(score, pos_th, neg_th),
         "is_question": is_question(text)
     }
 
-# ========= 6. 主程式 =========
-def main(video_id:str):
+# ========= 6. 向量化計分 =========
+# 斷詞結果轉成稀疏的 文件×詞彙 計數矩陣，分數 = 矩陣 · 詞典權重(±1)
+# 斷詞只需要做一次，調整門檻或詞典時直接重用快取的矩陣
+
+def build_token_matrix(token_lists, vocab=None):
+    """
+    將每則留言的斷詞結果轉成 CSR 計數矩陣
+
+    回傳:
+        (matrix, vocab)，vocab 為 {詞: 欄位索引}
+    """
+    vocab = {} if vocab is None else vocab
+    indptr = [0]
+    indices = []
+    for tokens in token_lists:
+        for w in tokens:
+            indices.append(vocab.setdefault(w, len(vocab)))
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.int32), indices, indptr),
+        shape=(len(token_lists), len(vocab))
+    )
+    matrix.sum_duplicates()
+    return matrix, vocab
+
+
+def lexicon_weights(vocab, positive_words=None, negative_words=None):
+    """
+    依詞典建立權重向量：正面詞 +1、負面詞 -1（與 sentiment_score 相同，正面優先）
+    """
+    positive_words = POSITIVE_WORDS if positive_words is None else positive_words
+    negative_words = NEGATIVE_WORDS if negative_words is None else negative_words
+
+    weights = np.zeros(len(vocab), dtype=np.int32)
+    for w, idx in vocab.items():
+        if w in positive_words:
+            weights[idx] = 1
+        elif w in negative_words:
+            weights[idx] = -1
+    return weights
+
+
+def score_matrix(matrix, weights):
+    return np.asarray(matrix @ weights).ravel()
+
+
+def sentiment_labels(scores, pos_th=2, neg_th=-2):
+    """
+    sentiment_label 的陣列版本
+    """
+    return np.select(
+        [scores >= pos_th, scores <= neg_th],
+        ["positive", "negative"],
+        default="neutral"
+    )
+
+
+def texts_hash(texts):
+    h = hashlib.sha256()
+    for t in texts:
+        h.update(t.encode("utf-8"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+
+def token_cache_path(video_id):
+    return artifacts.path(video_id, "tokens.npz")
+
+
+def save_token_matrix(path, matrix, vocab, digest):
+    words = sorted(vocab, key=vocab.get)
+    with artifacts.atomic_write(path) as tmp_path:
+        np.savez_compressed(
+            tmp_path,
+            data=matrix.data,
+            indices=matrix.indices,
+            indptr=matrix.indptr,
+            shape=np.array(matrix.shape),
+            vocab=np.array(words, dtype=str),
+            digest=np.array(digest)
+        )
+
+
+def load_token_matrix(path, digest=None):
+    """
+    讀取快取的斷詞矩陣；digest 與留言內容不符時回傳 None
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        if digest is not None and str(f["digest"]) != digest:
+            return None
+        matrix = sparse.csr_matrix(
+            (f["data"], f["indices"], f["indptr"]),
+            shape=tuple(f["shape"])
+        )
+        vocab = {w: i for i, w in enumerate(f["vocab"].tolist())}
+    return matrix, vocab
+
+
+def get_token_matrix(video_id, texts):
+    """
+    取得某支影片的斷詞矩陣，留言內容沒變時直接讀快取
+    """
+    path = token_cache_path(video_id)
+    digest = texts_hash(texts)
+
+    cached = load_token_matrix(path, digest)
+    if cached is not None:
+        print(f"♻️ 沿用斷詞快取：{path}")
+        return cached
+
+    matrix, vocab = build_token_matrix([jieba.lcut(t) for t in texts])
+    save_token_matrix(path, matrix, vocab, digest)
+    return matrix, vocab
+
+
+def sweep_thresholds(video_id, thresholds):
+    """
+    用快取的斷詞矩陣快速比較不同門檻的標籤分布
+
+    參數:
+        thresholds: [(pos_th, neg_th), ...]
+    回傳:
+        DataFrame，每組門檻一列，含 positive / neutral / negative 數量
+    """
+    df = pd.read_csv(comment_store.comments_path(video_id), usecols=["text"])
+    matrix, vocab = get_token_matrix(video_id, df["text"].astype(str).tolist())
+    scores = score_matrix(matrix, lexicon_weights(vocab))
+
+    rows = []
+    for pos_th, neg_th in thresholds:
+        labels = sentiment_labels(scores, pos_th, neg_th)
+        rows.append({
+            "pos_th": pos_th,
+            "neg_th": neg_th,
+            "positive": int((labels == "positive").sum()),
+            "neutral": int((labels == "neutral").sum()),
+            "negative": int((labels == "negative").sum()),
+        })
+    return pd.DataFrame(rows)
+
+
+# ========= 7. 分塊處理（大檔案） =========
+# 檔案超過這個大小時自動改用分塊模式，記憶體只和 chunksize 有關
+CHUNK_THRESHOLD_MB = 200
+DEFAULT_CHUNKSIZE = 50_000
+
+def classify_frame(df, pos_th=2, neg_th=-2):
+    """
+    對一個 DataFrame（或分塊）加上 sentiment_score / sentiment / is_question
+    """
+    texts = df["text"].astype(str)
+    matrix, vocab = build_token_matrix([jieba.lcut(t) for t in texts])
+    scores = score_matrix(matrix, lexicon_weights(vocab))
+    df["sentiment_score"] = scores
+    df["sentiment"] = sentiment_labels(scores, pos_th, neg_th)
+    df["is_question"] = texts.apply(is_question)
+    return df
+
+
+def _classify_chunk(args):
+    chunk, pos_th, neg_th = args
+    return classify_frame(chunk, pos_th, neg_th)
+
+
+def _iter_classified_chunks(reader, pos_th, neg_th, workers):
+    if workers <= 1:
+        for chunk in reader:
+            yield classify_frame(chunk, pos_th, neg_th)
+        return
+
+    # 最多同時保留 workers * 2 個分塊在處理中，避免一次把整個檔案讀進記憶體
+    # perf_trace 的取樣執行緒運作中，用 spawn 避免 fork 複製到被持有的鎖
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = deque()
+        for chunk in reader:
+            pending.append(pool.submit(_classify_chunk, (chunk, pos_th, neg_th)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main_chunked(video_id:str, pos_th=2, neg_th=-2, chunksize=DEFAULT_CHUNKSIZE, workers=1):
+    """
+    分塊讀取、分類並串流寫入暫存檔，完成後以 os.replace 原子性地替換原檔
+    """
+    filename = comment_store.comments_path(video_id)
+    total = 0
+
+    # 確認有 text 欄位（只讀表頭）
+    if "text" not in pd.read_csv(filename, nrows=0).columns:
+        raise ValueError("CSV 必須包含 'text' 欄位")
+
+    with perf_trace.span("classify.chunked", chunksize=chunksize, workers=workers) as record:
+        reader = pd.read_csv(filename, chunksize=chunksize)
+        with artifacts.atomic_write(filename) as tmp_filename:
+            with open(tmp_filename, "w", newline="", encoding="utf-8-sig") as f:
+                for i, chunk in enumerate(_iter_classified_chunks(reader, pos_th, neg_th, workers)):
+                    chunk.to_csv(f, index=False, header=(i == 0))
+                    total += len(chunk)
+                    print(f"已分類 {total} 則留言...")
+            # Windows 上來源檔仍開啟時無法替換
+            reader.close()
+        record["items"] = total
+    artifacts.record(video_id, filename)
+
+    print(f"✅ 分類完成，已輸出 {filename}（分塊模式，共 {total} 則）")
+
+
+# ========= 8. 主程式 =========
+def main(video_id:str, pos_th=2, neg_th=-2, chunksize=None, workers=1):
+    """
+    參數:
+        chunksize: 指定時使用分塊模式；未指定時檔案超過 CHUNK_THRESHOLD_MB 也會自動分塊
+        workers: 分塊模式下平行處理的行程數
+    """
+    filename = comment_store.comments_path(video_id)
+    if chunksize is None and os.path.getsize(filename) > CHUNK_THRESHOLD_MB * 1024 * 1024:
+        chunksize = DEFAULT_CHUNKSIZE
+    if chunksize:
+        return main_chunked(video_id, pos_th, neg_th, chunksize=chunksize, workers=workers)
+
     # 讀取 CSV
-    df = pd.read_csv(f"comments_{video_id}.csv")
+    with perf_trace.span("classify.read_csv") as record:
+        df = comment_store.load_comments(filename)
+        record["items"] = len(df)
 
     # 確認有 text 欄位
     if "text" not in df.columns:
         raise ValueError("CSV 必須包含 'text' 欄位")
 
-    # 套用分類
-    results = df["text"].astype(str).apply(classify_text)
+    texts = df["text"].astype(str)
+
+    # 斷詞（有快取時略過）並以稀疏矩陣計分
+    with perf_trace.span("classify.tokenize", items=len(df)):
+        matrix, vocab = get_token_matrix(video_id, texts.tolist())
 
-    # 拆成欄位
-    df["sentiment_score"] = results.apply(lambda x: x["sentiment_score"])
-    df["sentiment"] = results.apply(lambda x: x["sentiment"])
-    df["is_question"] = results.apply(lambda x: x["is_question"])
+    with perf_trace.span("classify.score", items=len(df)):
+        scores = score_matrix(matrix, lexicon_weights(vocab))
+        df["sentiment_score"] = pd.to_numeric(scores, downcast="integer")
+        df["sentiment"] = pd.Categorical(
+            sentiment_labels(scores, pos_th, neg_th),
+            dtype=comment_store.CSV_DTYPES["sentiment"]
+        )
+        df["is_question"] = texts.apply(is_question)
 
     # 使用安全寫入函數
-    filename = f"comments_{video_id}.csv"
-    safe_write_csv(df, filename)
+    with perf_trace.span("classify.write_csv", items=len(df)):
+        safe_write_csv(df, filename)
+    artifacts.record(video_id, filename)
     
     print(f"✅ 分類完成，已輸出 {filename}")
 
@@ -1,52 +1,53 @@
 import pandas as pd
 import numpy as np
-import time
 import os
 
-from sentence_transformers import SentenceTransformer
 from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_score
-import umap
 
 import jieba
 from sklearn.feature_extraction.text import TfidfVectorizer
 
+import artifacts
+import perf_trace
+import comment_store
+import similarity_index
+
 os.environ["OMP_NUM_THREADS"] = "1"
 
+KEYWORDS_FILE = "cluster_keywords.csv"   # 每支影片各自一份：artifacts/<video_id>/cluster_keywords.csv
+MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+
+# 同一個行程只載入一次模型（批次模式下每支影片共用）
+_model_cache = {}
+
+
+def get_model(model_name=MODEL_NAME):
+    if model_name not in _model_cache:
+        # 用到時才載入 sentence-transformers（連帶 torch），離線的 benchmark 與替身模型不需要
+        from sentence_transformers import SentenceTransformer
+        _model_cache[model_name] = SentenceTransformer(model_name)
+    return _model_cache[model_name]
+
+
+def keywords_path(video_id):
+    return artifacts.path(video_id, KEYWORDS_FILE)
+
+
+def set_model(model_name, model):
+    """
+    註冊自訂的向量模型（需提供與 SentenceTransformer 相同的 encode 介面），
+    例如 benchmark 使用的離線替身模型
+    """
+    _model_cache[model_name] = model
+
 
 # 安全的檔案寫入函數
-def safe_write_csv(df, filename, max_attempts=3):
+def safe_write_csv(df, filename):
     """
-    安全地寫入 CSV 檔案，如果失敗會重試
+    先寫暫存檔再原子替換；原檔被占用時重試，不會改存成其他檔名
     """
-    for attempt in range(max_attempts):
-        try:
-            # 如果不是第一次嘗試，使用不同的檔名
-            actual_filename = filename
-            if attempt > 0:
-                timestamp = int(time.time())
-                name_parts = filename.rsplit('.', 1)
-                actual_filename = f"{name_parts[0]}_{timestamp}.{name_parts[1]}"
-                print(f"⚠️ 原檔案被占用，嘗試使用新檔名：{actual_filename}")
-            
-            df.to_csv(actual_filename, index=False, encoding="utf-8-sig")
-            print(f"✅ 已儲存：{actual_filename}")
-            return actual_filename
-            
-        except PermissionError:
-            if attempt < max_attempts - 1:
-                print(f"⚠️ 檔案 {filename} 被其他程式占用，{2-attempt} 秒後重試...")
-                time.sleep(2)
-            else:
-                raise PermissionError(
-                    f"❌ 無法儲存檔案 {filename}！\n"
-                    f"可能原因：檔案已被 Excel 或其他程式打開\n"
-                    f"解決方法：關閉所有開啟該檔案的程式，或刪除舊檔案"
-                )
-        except Exception as e:
-            raise Exception(f"❌ 儲存檔案時發生錯誤：{str(e)}")
-    
-    return filename  # 如果都失敗，返回原檔名
+    return artifacts.write_csv(df, filename)
 
 
 # 基本清洗
@@ -71,9 +72,11 @@ def clean_comment_df(
 def find_best_k(embeddings, k_min=2, k_max=12):
     scores = {}
     for k in range(k_min, k_max + 1):
-        kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-        labels = kmeans.fit_predict(embeddings)
-        score = silhouette_score(embeddings, labels)
+        with perf_trace.span("cluster.find_best_k.k", k=k, items=len(embeddings)) as record:
+            kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+            labels = kmeans.fit_predict(embeddings)
+            score = silhouette_score(embeddings, labels)
+            record["silhouette"] = round(float(score), 4)
         scores[k] = score
         print(f"k={k}, silhouette={score:.4f}")
     return scores
@@ -146,12 +149,18 @@ def build_cluster_keyword_df(
     return pd.DataFrame(rows)
 
 
-def main(video_id):
+def main(video_id, min_len=3, k_min=2, k_max=10, model_name=MODEL_NAME):
+    """
+    回傳:
+        這支影片的聚類關鍵字 DataFrame（與寫入 cluster_keywords.csv 的內容相同）
+    """
     # 資料載入
-    df = pd.read_csv(f"comments_{video_id}.csv")
+    with perf_trace.span("cluster.read_csv") as record:
+        df = comment_store.load_comments(comment_store.comments_path(video_id))
+        record["items"] = len(df)
     comments = df["text"]
 
-    df_clean = clean_comment_df(df, text_col="text", id_col="comment_id", min_len=3)
+    df_clean = clean_comment_df(df, text_col="text", id_col="comment_id", min_len=min_len)
 
     comments = df_clean["text"].tolist()
     comment_ids = df_clean["comment_id"].tolist()
@@ -159,16 +168,22 @@ def main(video_id):
     print(f"有效留言數：{len(comments)}")
 
     # 建立「中文語意向量」
-    model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
+    with perf_trace.span("cluster.load_model", model=model_name):
+        model = get_model(model_name)
+
+    with perf_trace.span("cluster.embed", items=len(comments)):
+        embeddings = model.encode(
+            comments,
+            batch_size=64,
+            show_progress_bar=True,
+            normalize_embeddings=True
+        )
 
-    embeddings = model.encode(
-        comments,
-        batch_size=64,
-        show_progress_bar=True,
-        normalize_embeddings=True
-    )
+    # 保存正規化向量與最近鄰索引，供「找相似留言」使用
+    similarity_index.save_embeddings(video_id, comment_ids, embeddings, model_name)
 
     # 降維，讓聚類更穩定
+    import umap
     reducer = umap.UMAP(
         n_neighbors=15,
         n_components=5,
@@ -176,9 +191,11 @@ def main(video_id):
         random_state=42
     )
 
-    reduced_embeddings = reducer.fit_transform(embeddings)
+    with perf_trace.span("cluster.umap", items=len(comments)):
+        reduced_embeddings = reducer.fit_transform(embeddings)
 
-    scores = find_best_k(reduced_embeddings, 2, 10)
+    with perf_trace.span("cluster.find_best_k", k_min=k_min, k_max=k_max):
+        scores = find_best_k(reduced_embeddings, k_min, k_max)
     best_k = max(scores, key=scores.get)
     print("建議群數：", best_k)
 
@@ -189,7 +206,8 @@ def main(video_id):
         n_init=20
     )
 
-    labels = kmeans.fit_predict(reduced_embeddings)
+    with perf_trace.span("cluster.final_kmeans", k=int(best_k), items=len(comments)):
+        labels = kmeans.fit_predict(reduced_embeddings)
 
     # 整理結果
     df_cluster = pd.DataFrame({
@@ -203,9 +221,10 @@ def main(video_id):
 
     cluster_keywords = {}
 
-    for cid in sorted(df_cluster.cluster.unique()):
-        keywords = extract_cluster_keywords(df_cluster, cid, top_n=10)
-        cluster_keywords[cid] = keywords
+    with perf_trace.span("cluster.keywords", items=len(df_cluster)):
+        for cid in sorted(df_cluster.cluster.unique()):
+            keywords = extract_cluster_keywords(df_cluster, cid, top_n=10)
+            cluster_keywords[cid] = keywords
 
     for cid, kws in cluster_keywords.items():
         print(f"\n===== Cluster {cid} =====")
@@ -215,14 +234,20 @@ def main(video_id):
     cluster_kw_df = build_cluster_keyword_df(cluster_keywords, video_id=video_id, top_k=10)
     
     # 使用安全寫入函數
-    output_path = "cluster_keywords.csv"
-    safe_write_csv(cluster_kw_df, output_path)
+    output_path = keywords_path(video_id)
+    with perf_trace.span("cluster.write_csv", items=len(df)):
+        safe_write_csv(cluster_kw_df, output_path)
 
-    # 合併聚類結果到原始 DataFrame
-    df = df.merge(df_cluster[["comment_id", "cluster"]], on="comment_id", how="left")
-    
-    # 使用安全寫入函數
-    safe_write_csv(df, f"comments_{video_id}.csv")
+        # 合併聚類結果到原始 DataFrame（重新聚類時先移除舊的 cluster 欄位）
+        df = df.drop(columns=["cluster"], errors="ignore")
+        df = df.merge(df_cluster[["comment_id", "cluster"]], on="comment_id", how="left")
+
+        # 使用安全寫入函數
+        safe_write_csv(df, comment_store.comments_path(video_id))
+
+    # 留言與關鍵字以同一個版本登記，讀取端看到的 cluster 編號與關鍵字一致
+    artifacts.record_many(video_id, {output_path: {}, comment_store.comments_path(video_id): {}})
+    return cluster_kw_df
 
 
 if __name__ == "__main__":
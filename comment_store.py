@@ -0,0 +1,219 @@
+import glob
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import artifacts
+
+# ========= 1. 欄位型別 =========
+# read_csv 階段就直接套用，避免先產生 object 欄位再轉換
+CSV_DTYPES = {
+    "video_id": "category",
+    "comment_id": str,
+    # 頂層留言的 parent 就是自己，幾乎每列都不同，轉成 category 幾乎不省記憶體，比對與合併還會變慢
+    "parent_comment_id": str,
+    "author": "category",
+    "text": str,
+    "sentiment": pd.CategoricalDtype(["positive", "neutral", "negative"]),
+}
+
+BOOL_COLUMNS = ["is_reply", "is_question"]
+INT_COLUMNS = ["likeCount", "sentiment_score"]
+NULLABLE_INT_COLUMNS = ["cluster"]
+
+# 寫回 CSV 時維持 YouTube API 的時間格式
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# 留言檔超過這個大小時，畫面端改用 load_comments_offloaded：text 不進 DataFrame，需要時才以 memmap 讀取
+OFFLOAD_TEXT_MB = 100
+TEXT_POSITION = "text_pos"  # 外存模式下，每列在 TextStore 中的位置
+
+
+def optimize_dtypes(df):
+    """
+    縮小已載入 DataFrame 的記憶體：整數降階、布林化、時間解析
+    """
+    for col in INT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col].fillna(0), downcast="integer")
+
+    for col in NULLABLE_INT_COLUMNS:
+        if col in df.columns:
+            values = pd.to_numeric(df[col], errors="coerce")
+            max_value = values.max()
+            dtype = "Int8" if pd.isna(max_value) or max_value < 128 else "Int32"
+            df[col] = values.round().astype(dtype)
+
+    for col in BOOL_COLUMNS:
+        if col in df.columns and df[col].dtype != bool:
+            df[col] = df[col].astype(str).str.lower().eq("true")
+
+    if "publishedAt" in df.columns:
+        df["publishedAt"] = pd.to_datetime(df["publishedAt"], utc=True, errors="coerce")
+
+    return df
+
+
+# ========= 2. 載入 =========
+def comments_path(video_id):
+    return artifacts.path(video_id, "comments.csv")
+
+
+def load_comments(path, columns=None):
+    """
+    以精簡型別載入留言 CSV
+
+    參數:
+        path: CSV 路徑
+        columns: 只讀取部分欄位（None 為全部）
+    """
+    df = pd.read_csv(path, usecols=columns, dtype=CSV_DTYPES)
+    return optimize_dtypes(df)
+
+
+def load_comments_offloaded(path, columns=None):
+    """
+    載入留言但不把 text 放進記憶體；text 存成旁邊的二進位檔並以 memmap 隨需讀取
+
+    回傳:
+        (DataFrame, TextStore)，DataFrame 以 TEXT_POSITION 欄對應 TextStore 的位置，
+        篩選、排序後仍可用 with_text 取回文字
+    """
+    store = TextStore.for_csv(path)
+    if columns is not None:
+        columns = [c for c in columns if c != "text"]
+        df = pd.read_csv(path, usecols=columns, dtype=CSV_DTYPES)
+    else:
+        df = pd.read_csv(path, usecols=lambda c: c != "text", dtype=CSV_DTYPES)
+    df[TEXT_POSITION] = np.arange(len(df), dtype=np.int32 if len(df) < 2**31 else np.int64)
+    return optimize_dtypes(df), store
+
+
+def with_text(df, store):
+    """
+    外存模式下為（通常已篩選過的）DataFrame 補上 text 欄；一般模式原樣回傳
+    """
+    if store is None or "text" in df.columns:
+        return df
+    # 合併後找不到對應列的位置為缺值
+    return df.assign(text=[store[int(i)] if pd.notna(i) else None for i in df[TEXT_POSITION]])
+
+
+# ========= 3. 文字外存 =========
+class TextStore:
+    """
+    所有留言以 UTF-8 串接存在 .text.bin，另存每則的起訖位移 (.text.offsets.npy)
+    讀取時只透過 memmap 取出需要的列
+    """
+
+    def __init__(self, bin_path, offsets_path):
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        if self.offsets[-1] > 0:
+            self.data = np.memmap(bin_path, dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)  # 空檔案無法 memmap
+
+    @staticmethod
+    def paths_for(csv_path):
+        base = csv_path.rsplit(".", 1)[0]
+        return f"{base}.text.bin", f"{base}.text.offsets.npy"
+
+    @classmethod
+    def build(cls, csv_path, chunksize=100_000):
+        """
+        從 CSV 分塊讀取 text 欄位建立外存檔
+        """
+        bin_path, offsets_path = cls.paths_for(csv_path)
+        offsets = [0]
+        with artifacts.atomic_write(bin_path) as tmp_path, open(tmp_path, "wb") as f:
+            for chunk in pd.read_csv(csv_path, usecols=["text"], dtype=str, keep_default_na=False, chunksize=chunksize):
+                for text in chunk["text"]:
+                    encoded = text.encode("utf-8")
+                    f.write(encoded)
+                    offsets.append(offsets[-1] + len(encoded))
+        # offsets 最後寫入，for_csv 以它的時間判斷外存檔是否完整且最新
+        with artifacts.atomic_write(offsets_path) as tmp_path:
+            np.save(tmp_path, np.asarray(offsets, dtype=np.int64))
+        cls._prune(csv_path)
+        return cls(bin_path, offsets_path)
+
+    @classmethod
+    def _prune(cls, csv_path):
+        # manifest 版本檔（comments.v12.csv）各自有外存檔；已清掉的版本，外存檔也一併刪除
+        bin_path, _ = cls.paths_for(csv_path)
+        stem = os.path.basename(csv_path).split(".", 1)[0]
+        for old in glob.glob(os.path.join(os.path.dirname(csv_path), f"{glob.escape(stem)}.*.text.*")):
+            source = old.rsplit(".text.", 1)[0] + ".csv"
+            if os.path.exists(source):
+                continue
+            try:
+                os.remove(old)
+            except OSError:
+                # Windows 上讀取端仍以 memmap 開著，下次再刪
+                pass
+
+    @classmethod
+    def for_csv(cls, csv_path):
+        """
+        外存檔比 CSV 舊或不存在時重新建立
+        """
+        bin_path, offsets_path = cls.paths_for(csv_path)
+        if (
+            os.path.exists(offsets_path)
+            and os.path.getmtime(offsets_path) >= os.path.getmtime(csv_path)
+        ):
+            return cls(bin_path, offsets_path)
+        return cls.build(csv_path)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.data[start:end]).decode("utf-8")
+
+    def take(self, positions):
+        return [self[int(i)] for i in positions]
+
+
+# ========= 4. 記憶體報告 =========
+def frame_memory_mb(df):
+    return round(df.memory_usage(deep=True).sum() / (1024 * 1024), 2)
+
+
+def memory_report(path):
+    """
+    比較預設 read_csv、精簡型別、以及 text 外存三種載入方式的記憶體用量
+    """
+    default_df = pd.read_csv(path)
+    before = frame_memory_mb(default_df)
+    per_column_before = default_df.memory_usage(deep=True)
+    del default_df
+
+    compact_df = load_comments(path)
+    after = frame_memory_mb(compact_df)
+    per_column_after = compact_df.memory_usage(deep=True)
+    rows = len(compact_df)
+    del compact_df
+
+    offloaded_df, _ = load_comments_offloaded(path)
+    offloaded = frame_memory_mb(offloaded_df)
+
+    report = pd.DataFrame({
+        "預設 (MB)": (per_column_before / (1024 * 1024)).round(2),
+        "精簡 (MB)": (per_column_after / (1024 * 1024)).round(2),
+    })
+    print(report.to_string())
+    print(f"\n列數：{rows}")
+    print(f"預設載入：{before} MB")
+    print(f"精簡型別：{after} MB（{after / before:.0%}）" if before else f"精簡型別：{after} MB")
+    print(f"text 外存：{offloaded} MB（text 改由 memmap 讀取）")
+    return {"default_mb": before, "compact_mb": after, "offloaded_mb": offloaded}
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else input("請輸入 YouTube 影片 ID 或 CSV 路徑：").strip()
+    path = target if target.endswith(".csv") else comments_path(target)
+    memory_report(path)
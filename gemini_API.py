@@ -2,6 +2,8 @@ import pandas as pd
 from google import genai
 import time
 import streamlit as st
+import perf_trace
+import comment_store
 
 # --- 設定 ---
 GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
@@ -23,10 +25,12 @@ def safe_analyze(csv_file_path:str, question:str):
         
         try:
             print(f"正在處理第 {i+1} ~ {i+len(batch)} 則留言...")
-            response = client.models.generate_content(
-                model='gemini-2.5-flash-lite', # Flash 是免費版最穩定的
-                contents=prompt
-            )
+            with perf_trace.span("gemini.generate_content", items=len(batch)):
+                response = client.models.generate_content(
+                    model='gemini-2.5-flash-lite', # Flash 是免費版最穩定的
+                    contents=prompt
+                )
+            perf_trace.count("gemini.generate_content")
             print("分析結果：", response.text)
             
             # 存檔邏輯...(這部分暫略)
@@ -37,6 +41,7 @@ def safe_analyze(csv_file_path:str, question:str):
         except Exception as e:
             if "429" in str(e):
                 print("觸發頻率限制！冷卻 60 秒...")
+                perf_trace.count("gemini.rate_limited")
                 time.sleep(60)
             else:
                 print(f"發生錯誤: {e}")
@@ -90,10 +95,13 @@ def analyze_comments_all(file_path, question, selected_comments=None):
         # 3. 呼叫 Gemini 2.0 或 1.5 Flash
         # 免費方案目前推薦使用 'gemini-2.0-flash' 或 'gemini-1.5-flash'
         print(f"正在分析 {len(comments)} 則留言...")
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-lite", 
-            contents=prompt
-        )
+        with perf_trace.span("gemini.generate_content", items=len(comments)):
+            response = client.models.generate_content(
+                model="gemini-2.5-flash-lite", 
+                contents=prompt
+            )
+        perf_trace.count("gemini.generate_content")
+        perf_trace.count("gemini.prompt_chars", len(prompt))
         
         return response.text
 
@@ -103,6 +111,6 @@ def analyze_comments_all(file_path, question, selected_comments=None):
 if __name__ == "__main__":
     video_id = input("請輸入 YouTube 影片 ID：").strip()
     question = input("請輸入要對 Gemini 說的話：").strip()
-    csv_file_path = f"comments_{video_id}.csv"
+    csv_file_path = comment_store.comments_path(video_id)
     # safe_analyze(csv_file_path, question)
     safe_analyze(csv_file_path, question)
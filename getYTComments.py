@@ -1,102 +1,241 @@
 import csv
 import googleapiclient.discovery
+import httplib2
 import os
 import time
 import streamlit as st
-API_KEY = st.secrets["YOUTUBE_API_KEY"]
+import artifacts
+import comment_store
+import perf_trace
 
-def get_all_comments(video_id):
+
+def api_key():
+    # 用到時才讀取，匯入模組（例如背景 worker、測試）不需要 secrets
+    return st.secrets["YOUTUBE_API_KEY"]
+
+# 每次 list 呼叫消耗的配額單位
+QUOTA_COST_LIST = 1
+
+# ========= 抓取模式 =========
+# full：完整資源 + 補抓所有回應（原本的行為）
+# lean：以 fields 只取需要的欄位，資料與 full 相同但傳輸量小很多
+# pulse：只抓依相關性排序的前 N 串頂層留言，適合快速看風向
+FETCH_PROFILES = {
+    "full": {"lean": False, "skip_replies": False, "max_replies": None, "top_n": None},
+    "lean": {"lean": True, "skip_replies": False, "max_replies": None, "top_n": None},
+    "pulse": {"lean": True, "skip_replies": True, "max_replies": None, "top_n": 500},
+}
+
+# partial response：只保留寫入 CSV 的八個欄位
+COMMENT_FIELDS = "id,snippet(authorDisplayName,textDisplay,likeCount,publishedAt)"
+THREAD_FIELDS = f"nextPageToken,items(snippet(totalReplyCount,topLevelComment({COMMENT_FIELDS})),replies/comments({COMMENT_FIELDS}))"
+THREAD_FIELDS_NO_REPLIES = f"nextPageToken,items(snippet(totalReplyCount,topLevelComment({COMMENT_FIELDS})))"
+REPLY_FIELDS = f"nextPageToken,items({COMMENT_FIELDS})"
+
+
+def new_stats(profile):
+    return {
+        "profile": profile,
+        "requests": {"commentThreads.list": 0, "comments.list": 0},
+        "quota_units": 0,
+        "bytes": 0,
+        "gzip_responses": 0,
+        "threads": 0,
+        "replies": 0,
+    }
+
+
+class CountingHttp(httplib2.Http):
+    """
+    記錄每個回應的大小；googleapiclient 預設就會送出 Accept-Encoding: gzip，
+    httplib2 解壓後 content-encoding 會改放在 "-content-encoding"
+    """
+
+    def __init__(self, stats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def request(self, *args, **kwargs):
+        resp, content = super().request(*args, **kwargs)
+        self.stats["bytes"] += len(content)
+        perf_trace.count("youtube.bytes", len(content))
+        if resp.get("-content-encoding") == "gzip":
+            self.stats["gzip_responses"] += 1
+        return resp, content
+
+
+def _count_request(stats, endpoint):
+    stats["requests"][endpoint] += 1
+    stats["quota_units"] += QUOTA_COST_LIST
+    perf_trace.count(f"youtube.{endpoint}")
+    perf_trace.count("youtube.quota_units", QUOTA_COST_LIST)
+
+
+def _row(video_id, comment, parent_id, is_reply):
+    return {
+        "video_id": video_id,
+        "comment_id": comment["id"],
+        "parent_comment_id": parent_id,
+        "is_reply": is_reply,
+        "author": comment["snippet"]["authorDisplayName"],
+        "text": comment["snippet"]["textDisplay"],
+        "likeCount": comment["snippet"]["likeCount"],
+        "publishedAt": comment["snippet"]["publishedAt"]
+    }
+
+
+def get_all_comments(video_id, profile="full", stats=None, **options):
+    """
+    抓取影片的所有留言（含回應）
+
+    參數:
+        video_id: YouTube 影片 ID
+        profile: 抓取模式，見 FETCH_PROFILES（"full" / "lean" / "pulse"）
+        stats: 傳入 dict 時會填入請求數、配額、傳輸量等統計
+        options: 覆寫模式的個別設定
+            lean: 使用 fields 部分回應
+            skip_replies: 不抓回應，只保留頂層留言
+            max_replies: 每串最多保留的回應數（None 為不限）
+            top_n: 只抓依相關性排序的前 N 串（None 為全部，依時間排序）
+    回傳:
+        list of dict，每則留言一列
+    """
+    settings = {**FETCH_PROFILES[profile], **options}
+    if stats is None:
+        stats = {}
+    stats.update(new_stats(profile))
+
+    with perf_trace.span("fetch.get_all_comments", profile=profile) as record:
+        rows = _get_all_comments(video_id, stats, **settings)
+        record["items"] = len(rows)
+        record["bytes"] = stats["bytes"]
+
+    print(
+        f"📡 抓取模式 {profile}：{stats['threads']} 串、{stats['replies']} 則回應，"
+        f"{sum(stats['requests'].values())} 次請求、{stats['quota_units']} 配額單位、"
+        f"{stats['bytes'] / 1024:.1f} KB"
+    )
+    return rows
+
+
+def _get_all_comments(video_id, stats, lean=False, skip_replies=False, max_replies=None, top_n=None):
     youtube = googleapiclient.discovery.build(
-        "youtube", "v3", developerKey=API_KEY
+        "youtube", "v3", developerKey=api_key(), http=CountingHttp(stats)
     )
 
+    if skip_replies:
+        max_replies = 0
+    list_options = {"part": "snippet" if max_replies == 0 else "snippet,replies"}
+    if lean:
+        list_options["fields"] = THREAD_FIELDS_NO_REPLIES if max_replies == 0 else THREAD_FIELDS
+    if top_n is not None:
+        list_options["order"] = "relevance"
+
     rows = []
     next_page_token = None
 
     while True:
+        page_size = 100 if top_n is None else min(100, top_n - stats["threads"])
         request = youtube.commentThreads().list(
-            part="snippet,replies",
             videoId=video_id,
-            maxResults=100,
+            maxResults=page_size,
             pageToken=next_page_token,
-            textFormat="plainText"
+            textFormat="plainText",
+            **list_options
         )
         response = request.execute()
+        _count_request(stats, "commentThreads.list")
 
         for item in response["items"]:
             top = item["snippet"]["topLevelComment"]
             top_id = top["id"]
 
             # 頂級留言
-            rows.append({
-                "video_id": video_id,
-                "comment_id": top_id,
-                "parent_comment_id": top_id,
-                "is_reply": False,
-                "author": top["snippet"]["authorDisplayName"],
-                "text": top["snippet"]["textDisplay"],
-                "likeCount": top["snippet"]["likeCount"],
-                "publishedAt": top["snippet"]["publishedAt"]
-            })
-
-            collected_replies = []
-
-            # API 預設回傳的 replies
-            if "replies" in item:
-                for reply in item["replies"]["comments"]:
-                    collected_replies.append(reply)
-
-            # 如果回應沒拿齊 → 補抓
-            if item["snippet"]["totalReplyCount"] > len(collected_replies):
-                collected_replies.extend(
-                    get_remaining_replies(youtube, top_id)
+            rows.append(_row(video_id, top, top_id, False))
+            stats["threads"] += 1
+
+            if max_replies == 0:
+                continue
+
+            # API 預設回傳的 replies（最多 5 則）
+            collected_replies = item.get("replies", {}).get("comments", [])
+
+            # 如果回應沒拿齊 → 補抓（comments.list 會從頭回傳，包含上面已有的回應）
+            total = item["snippet"]["totalReplyCount"]
+            wanted = total if max_replies is None else min(total, max_replies)
+            if wanted > len(collected_replies):
+                collected_replies = collected_replies + get_remaining_replies(
+                    youtube, top_id, limit=max_replies, lean=lean, stats=stats
                 )
 
-            # 回應留言
+            # 依 reply id 去除重複
+            seen = set()
+            unique_replies = []
             for reply in collected_replies:
-                rows.append({
-                    "video_id": video_id,
-                    "comment_id": reply["id"],
-                    "parent_comment_id": top_id,
-                    "is_reply": True,
-                    "author": reply["snippet"]["authorDisplayName"],
-                    "text": reply["snippet"]["textDisplay"],
-                    "likeCount": reply["snippet"]["likeCount"],
-                    "publishedAt": reply["snippet"]["publishedAt"]
-                })
+                if reply["id"] not in seen:
+                    seen.add(reply["id"])
+                    unique_replies.append(reply)
+            if max_replies is not None:
+                unique_replies = unique_replies[:max_replies]
+
+            # 回應留言
+            for reply in unique_replies:
+                rows.append(_row(video_id, reply, top_id, True))
+            stats["replies"] += len(unique_replies)
 
         next_page_token = response.get("nextPageToken")
-        if not next_page_token:
+        if not next_page_token or (top_n is not None and stats["threads"] >= top_n):
             break
 
     return rows
 
 
-def get_remaining_replies(youtube, parent_id):
+def get_remaining_replies(youtube, parent_id, limit=None, lean=False, stats=None):
     replies = []
     next_page_token = None
+    extra = {"fields": REPLY_FIELDS} if lean else {}
 
     while True:
+        page_size = 100 if limit is None else min(100, limit - len(replies))
         request = youtube.comments().list(
             part="snippet",
             parentId=parent_id,
-            maxResults=100,
+            maxResults=page_size,
             pageToken=next_page_token,
-            textFormat="plainText"
+            textFormat="plainText",
+            **extra
         )
         response = request.execute()
+        if stats is not None:
+            _count_request(stats, "comments.list")
+        else:
+            perf_trace.count("youtube.comments.list")
+            perf_trace.count("youtube.quota_units", QUOTA_COST_LIST)
 
         replies.extend(response["items"])
 
         next_page_token = response.get("nextPageToken")
-        if not next_page_token:
+        if not next_page_token or (limit is not None and len(replies) >= limit):
             break
 
     return replies
 
 
-def save_to_csv(video_id, rows):
-    filename = f"comments_{video_id}.csv"
+def save_to_csv(video_id, rows, **meta):
+    """
+    寫入 artifacts/<video_id>/comments.csv 並登記到 manifest
+
+    參數:
+        meta: 一併記錄在 manifest 的資訊（例如抓取模式）
+    """
+    with perf_trace.span("fetch.save_csv", items=len(rows)):
+        filename = _save_to_csv(video_id, rows)
+    artifacts.record(video_id, filename, rows=len(rows), fetched_at=time.time(), **meta)
+    return filename
+
+
+def _save_to_csv(video_id, rows):
+    filename = comment_store.comments_path(video_id)
     fieldnames = [
         "video_id",
         "comment_id",
@@ -108,46 +247,21 @@ def save_to_csv(video_id, rows):
         "publishedAt"
     ]
 
-    # 嘗試寫入檔案，如果失敗則使用備用檔名
-    max_attempts = 3
-    for attempt in range(max_attempts):
-        try:
-            # 如果不是第一次嘗試，使用不同的檔名
-            if attempt > 0:
-                timestamp = int(time.time())
-                filename = f"comments_{video_id}_{timestamp}.csv"
-                print(f"⚠️ 原檔案被占用，嘗試使用新檔名：{filename}")
-            
-            with open(filename, "w", newline="", encoding="utf-8-sig") as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(rows)
-            
-            print(f"✅ 已儲存：{filename}")
-            return filename  # 回傳實際使用的檔名
-            
-        except PermissionError:
-            if attempt < max_attempts - 1:
-                print(f"⚠️ 檔案 {filename} 被其他程式占用，{2-attempt} 秒後重試...")
-                time.sleep(2)
-            else:
-                # 最後一次嘗試失敗
-                raise PermissionError(
-                    f"❌ 無法儲存檔案！\n"
-                    f"可能原因：\n"
-                    f"1. 檔案 {filename} 已被 Excel 或其他程式打開\n"
-                    f"2. 資料夾沒有寫入權限\n"
-                    f"\n解決方法：\n"
-                    f"1. 關閉所有開啟該檔案的程式\n"
-                    f"2. 或刪除/重新命名舊的 CSV 檔案"
-                )
-        except Exception as e:
-            raise Exception(f"❌ 儲存檔案時發生錯誤：{str(e)}")
+    # 先寫暫存檔再替換；原檔被占用時會重試，不會改存成其他檔名
+    with artifacts.atomic_write(filename) as tmp_path:
+        with open(tmp_path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    print(f"✅ 已儲存：{filename}")
+    return filename
 
 
 if __name__ == "__main__":
     video_id = input("請輸入 YouTube 影片 ID：").strip()
-    rows = get_all_comments(video_id)
-    save_to_csv(video_id, rows)
+    profile = input(f"抓取模式 {'/'.join(FETCH_PROFILES)}（預設 full）：").strip() or "full"
+    rows = get_all_comments(video_id, profile=profile)
+    save_to_csv(video_id, rows, profile=profile)
 
     print(f"共存入 {len(rows)} 則留言（含回應）")
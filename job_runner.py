@@ -0,0 +1,324 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+import pipeline
+from artifacts import file_lock, read_json as _read_json, write_json as _write_json
+
+# ========= 1. 設定 =========
+JOBS_DIR = "jobs"
+WORKERS_DIR = os.path.join(JOBS_DIR, "workers")
+QUEUE_LOCK = os.path.join(JOBS_DIR, "queue.lock")
+
+MAX_WORKERS = 2            # 同時執行的背景 worker 數量上限
+POLL_SECONDS = 2           # worker 檢查佇列 / UI 輪詢的間隔
+HEARTBEAT_SECONDS = 5      # worker 心跳間隔
+HEARTBEAT_TIMEOUT = 30     # 超過這個秒數沒有心跳，視為 worker 已死亡
+STARTUP_TIMEOUT = 120      # 剛啟動的 worker 載入模型等套件的時間上限，期間仍算在 worker 數量內
+MAX_ATTEMPTS = 3           # 工作因 worker 中斷被重新排隊的次數上限
+IDLE_EXIT_SECONDS = 60     # 佇列空閒多久後 worker 自動結束
+
+ACTIVE_STATES = ("queued", "running")
+
+
+# ========= 2. 工作檔 =========
+def job_path(video_id):
+    return os.path.join(JOBS_DIR, f"{video_id}.json")
+
+
+def read_job(video_id):
+    return _read_json(job_path(video_id))
+
+
+def _update_job(video_id, **fields):
+    with file_lock(QUEUE_LOCK):
+        job = read_job(video_id) or {}
+        job.update(fields)
+        _write_json(job_path(video_id), job)
+    return job
+
+
+# ========= 3. Worker 狀態 =========
+def _worker_file(worker_id):
+    return os.path.join(WORKERS_DIR, f"{worker_id}.alive")
+
+
+def _starting_file(worker_id):
+    return os.path.join(WORKERS_DIR, f"{worker_id}.starting")
+
+
+def _worker_alive(worker_id):
+    try:
+        return time.time() - os.path.getmtime(_worker_file(worker_id)) < HEARTBEAT_TIMEOUT
+    except (FileNotFoundError, TypeError):
+        return False
+
+
+def _live_workers():
+    """
+    有心跳的 worker，加上已啟動但還在載入套件、尚未開始心跳的 worker
+    """
+    if not os.path.isdir(WORKERS_DIR):
+        return []
+    workers = set()
+    for name in os.listdir(WORKERS_DIR):
+        worker_id, ext = os.path.splitext(name)
+        path = os.path.join(WORKERS_DIR, name)
+        if ext == ".alive":
+            alive = _worker_alive(worker_id)
+        elif ext == ".starting":
+            try:
+                alive = time.time() - os.path.getmtime(path) < STARTUP_TIMEOUT
+            except FileNotFoundError:
+                continue
+        else:
+            continue
+        if alive:
+            workers.add(worker_id)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return sorted(workers)
+
+
+def _start_worker(worker_id):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    log = open(os.path.join(JOBS_DIR, "worker.log"), "a", encoding="utf-8")
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS
+    else:
+        # 脫離 Streamlit 的 session，瀏覽器重新整理也不會中斷
+        kwargs["start_new_session"] = True
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "worker", worker_id],
+        cwd=os.getcwd(),
+        stdout=log,
+        stderr=subprocess.STDOUT,
+        stdin=subprocess.DEVNULL,
+        **kwargs
+    )
+    log.close()
+
+
+def ensure_workers():
+    """
+    確保有足夠的 worker 處理佇列中的工作（不超過 MAX_WORKERS）
+    """
+    with file_lock(QUEUE_LOCK):
+        queued = [j for j in _all_jobs() if j.get("status") == "queued"]
+        missing = min(len(queued), MAX_WORKERS) - len(_live_workers())
+        # 釋放鎖之前先登記，同時送出的其他請求會把它算進 worker 數量
+        os.makedirs(WORKERS_DIR, exist_ok=True)
+        for _ in range(max(0, missing)):
+            worker_id = f"{os.getpid()}-{time.time_ns()}"
+            with open(_starting_file(worker_id), "w") as f:
+                f.write(str(os.getpid()))
+            _start_worker(worker_id)
+
+
+# ========= 4. 佇列操作 =========
+def _all_jobs():
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    jobs = []
+    for name in os.listdir(JOBS_DIR):
+        if name.endswith(".json"):
+            job = _read_json(os.path.join(JOBS_DIR, name))
+            if job:
+                jobs.append(job)
+    return jobs
+
+
+def _new_job(video_id, force=False, fetch_profile="full"):
+    return {
+        "video_id": video_id,
+        "status": "queued",
+        "force": force,
+        "fetch_profile": fetch_profile,
+        "submitted_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "worker": None,
+        "stages": {stage: {"state": "pending"} for stage in pipeline.STAGES},
+        "result": {},
+        "error": None,
+        "error_type": None,
+    }
+
+
+def submit_job(video_id, force=False, fetch_profile="full"):
+    """
+    送出一個影片分析工作；同一個 video_id 已在排隊或執行中時直接回傳既有工作
+
+    參數:
+        force: True 時忽略階段快取，全部重新計算
+        fetch_profile: 抓取模式（"full" / "lean" / "pulse"）
+    """
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    with file_lock(QUEUE_LOCK):
+        job = read_job(video_id)
+        duplicated = (
+            job is not None
+            and job.get("status") in ACTIVE_STATES
+            and (job["status"] == "queued" or _worker_alive(job.get("worker")))
+        )
+        if not duplicated:
+            job = _new_job(video_id, force=force, fetch_profile=fetch_profile)
+            _write_json(job_path(video_id), job)
+    ensure_workers()
+    return job
+
+
+def _recover_stale(job):
+    """
+    worker 中斷（沒有心跳）時把它手上的工作放回佇列；重試太多次則標記為失敗
+    需在 QUEUE_LOCK 之內呼叫，有變動時回傳 True
+    """
+    if job.get("status") != "running" or _worker_alive(job.get("worker")):
+        return False
+    if job.get("attempts", 1) >= MAX_ATTEMPTS:
+        job.update(
+            status="error",
+            error=f"背景 worker 中斷，已重試 {job.get('attempts', 1)} 次",
+            error_type="WorkerLost",
+            finished_at=time.time(),
+        )
+    else:
+        job.update(status="queued", worker=None)
+    _write_json(job_path(job["video_id"]), job)
+    return True
+
+
+def _claim_next_job(worker_id):
+    with file_lock(QUEUE_LOCK):
+        queued = []
+        for job in _all_jobs():
+            _recover_stale(job)
+            if job.get("status") == "queued":
+                queued.append(job)
+
+        if not queued:
+            return None
+
+        job = min(queued, key=lambda j: j["submitted_at"])
+        job["status"] = "running"
+        job["worker"] = worker_id
+        job["started_at"] = time.time()
+        job["attempts"] = job.get("attempts", 0) + 1
+        _write_json(job_path(job["video_id"]), job)
+        return job
+
+
+def poll_job(video_id):
+    """
+    UI 輪詢用：讀取工作狀態，順便處理 worker 中斷的工作，並確保排隊中的工作有 worker 接手
+    """
+    with file_lock(QUEUE_LOCK):
+        job = read_job(video_id)
+        if job is not None:
+            _recover_stale(job)
+    if job is not None and job.get("status") == "queued":
+        ensure_workers()
+    return job
+
+
+def _run_job(job):
+    video_id = job["video_id"]
+    stages = job["stages"]
+
+    def on_stage(stage, state, info):
+        stages[stage]["state"] = state
+        stages[stage][f"{state}_at"] = time.time()
+        if info:
+            stages[stage]["info"] = info
+        _update_job(video_id, stages=stages)
+        print(f"[{video_id}] {stage}: {state}")
+
+    try:
+        results = pipeline.run_pipeline(
+            video_id,
+            on_stage=on_stage,
+            force=job.get("force", False),
+            fetch_profile=job.get("fetch_profile", "full")
+        )
+        _update_job(
+            video_id,
+            status="done",
+            result={**results.get("fetch", {}), "report": results["report"]},
+            finished_at=time.time()
+        )
+    except Exception as e:
+        for stage in stages.values():
+            if stage["state"] == "running":
+                stage["state"] = "error"
+        traceback.print_exc()
+        _update_job(
+            video_id,
+            status="error",
+            stages=stages,
+            error=str(e),
+            error_type=type(e).__name__,
+            finished_at=time.time()
+        )
+
+
+# ========= 5. Worker 主迴圈 =========
+def worker_loop(worker_id=None):
+    os.makedirs(WORKERS_DIR, exist_ok=True)
+    worker_id = worker_id or f"{os.getpid()}-{time.time_ns()}"
+    alive_file = _worker_file(worker_id)
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.is_set():
+            with open(alive_file, "w") as f:
+                f.write(str(os.getpid()))
+            # 開始心跳後就不再需要啟動中的登記
+            try:
+                os.remove(_starting_file(worker_id))
+            except FileNotFoundError:
+                pass
+            stop.wait(HEARTBEAT_SECONDS)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    print(f"🚀 worker {worker_id} 啟動")
+
+    idle_since = time.time()
+    try:
+        while True:
+            job = _claim_next_job(worker_id)
+            if job is None:
+                if time.time() - idle_since > IDLE_EXIT_SECONDS:
+                    break
+                time.sleep(POLL_SECONDS)
+                continue
+            _run_job(job)
+            idle_since = time.time()
+    finally:
+        stop.set()
+        try:
+            os.remove(alive_file)
+        except FileNotFoundError:
+            pass
+        print(f"👋 worker {worker_id} 結束")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "worker"
+    if command == "worker":
+        worker_loop(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif command == "submit":
+        for vid in sys.argv[2:]:
+            print(submit_job(vid)["status"], vid)
+    elif command == "status":
+        for vid in sys.argv[2:]:
+            print(json.dumps(read_job(vid), ensure_ascii=False, indent=2))
+    else:
+        print("用法：python job_runner.py [worker | submit VIDEO_ID... | status VIDEO_ID...]")
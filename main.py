@@ -1,15 +1,168 @@
-import getYTComments
-import classify_comments
-import cluster_comments
+import argparse
+import csv
+import multiprocessing
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
+import pipeline
+
+
+# ========= 1. 讀取影片清單 =========
+def read_video_ids(video_ids=None, file_path=None):
+    """
+    從參數與檔案（每行一個 ID，# 開頭為註解）收集影片 ID，去除重複並保留順序
+    """
+    ids = list(video_ids or [])
+    if file_path:
+        with open(file_path, "r", encoding="utf-8-sig") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    ids.append(line)
+    return list(dict.fromkeys(ids))
+
+
+# ========= 2. 批次工作 =========
+def _init_worker():
+    # 每個分析行程只載入一次模型與詞典，之後的影片共用
+    import cluster_comments
+    cluster_comments.get_model()
+
+
+def _timed(func, video_id):
+    start = time.time()
+    result = func(video_id)
+    return result, time.time() - start
+
+
+def _fetch(video_id, profile="full"):
+    return pipeline.run_pipeline(video_id, stages=["fetch"], fetch_profile=profile)["fetch"]
+
+
+def _analyze(video_id, force=False):
+    return pipeline.run_pipeline(video_id, stages=["classify", "cluster", "rollup"], force=force)
+
+
+def write_summary(summary, path):
+    fieldnames = [
+        "video_id", "status", "rows", "requests", "quota_units", "kilobytes",
+        "stages", "fetch_seconds", "analyze_seconds", "error",
+    ]
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(summary)
+    print(f"✅ 已儲存批次摘要：{path}")
 
-if __name__ == "__main__":
-    video_id = input("請輸入 YouTube 影片 ID：").strip()
-    rows = getYTComments.get_all_comments(video_id)
-    getYTComments.save_to_csv(video_id, rows)
 
-    print(f"共存入 {len(rows)} 則留言（含回應）")
+def run_batch(video_ids, fetch_workers=4, process_workers=2, summary_path=None, force=False, fetch_profile="full"):
+    """
+    批次分析多支影片
 
-    classify_comments.main(video_id)
+    抓取是 I/O 密集，使用執行緒池並行；分類與聚類是 CPU 密集，使用行程池。
+    每支影片抓取完成後立即送進分析行程池，單一影片失敗不會中斷整個批次。
+
+    回傳:
+        list[dict]，每支影片的結果摘要
+    """
+    summary = {
+        vid: {"video_id": vid, "status": "pending", "rows": None, "requests": None,
+              "quota_units": None, "kilobytes": None, "stages": None,
+              "fetch_seconds": None, "analyze_seconds": None, "error": None}
+        for vid in video_ids
+    }
+
+    # 分析行程在抓取執行緒（及 perf_trace 的取樣執行緒）運作中才啟動，
+    # fork 會複製其他執行緒持有中的鎖而可能卡死，改用 spawn 啟動乾淨的行程
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetch_pool, \
+            ProcessPoolExecutor(
+                max_workers=process_workers,
+                initializer=_init_worker,
+                mp_context=multiprocessing.get_context("spawn")
+            ) as analyze_pool:
+
+        fetch_futures = {
+            fetch_pool.submit(_timed, partial(_fetch, profile=fetch_profile), vid): vid
+            for vid in video_ids
+        }
+        analyze_futures = {}
+
+        for future in as_completed(fetch_futures):
+            vid = fetch_futures[future]
+            try:
+                info, seconds = future.result()
+                stats = info["fetch_stats"]
+                summary[vid]["rows"] = info["rows"]
+                summary[vid]["requests"] = sum(stats["requests"].values())
+                summary[vid]["quota_units"] = stats["quota_units"]
+                summary[vid]["kilobytes"] = round(stats["bytes"] / 1024, 1)
+                summary[vid]["fetch_seconds"] = round(seconds, 2)
+                print(f"📥 [{vid}] 抓取完成：{info['rows']} 則留言")
+                analyze_futures[analyze_pool.submit(_timed, partial(_analyze, force=force), vid)] = vid
+            except Exception as e:
+                summary[vid]["status"] = "fetch_failed"
+                summary[vid]["error"] = str(e)
+                print(f"❌ [{vid}] 抓取失敗：{e}")
+
+        for future in as_completed(analyze_futures):
+            vid = analyze_futures[future]
+            try:
+                results, seconds = future.result()
+                summary[vid]["status"] = "done"
+                summary[vid]["stages"] = " ".join(f"{k}:{v}" for k, v in results["report"].items())
+                summary[vid]["analyze_seconds"] = round(seconds, 2)
+                print(f"✅ [{vid}] 分析完成（{seconds:.1f} 秒）")
+            except Exception as e:
+                summary[vid]["status"] = "analyze_failed"
+                summary[vid]["error"] = str(e)
+                print(f"❌ [{vid}] 分析失敗：{e}")
+
+    results = [summary[vid] for vid in video_ids]
+
+    if summary_path is None:
+        summary_path = f"batch_summary_{int(time.time())}.csv"
+    write_summary(results, summary_path)
+
+    done = sum(1 for r in results if r["status"] == "done")
+    print(f"共 {len(results)} 支影片，成功 {done} 支，失敗 {len(results) - done} 支")
+    quota = sum(r["quota_units"] or 0 for r in results)
+    print(f"抓取模式 {fetch_profile}：共消耗 {quota} 配額單位")
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="YouTube 留言抓取、情緒分類與語意聚類")
+    parser.add_argument("video_ids", nargs="*", help="一或多個 YouTube 影片 ID")
+    parser.add_argument("-f", "--file", help="影片 ID 清單檔（每行一個）")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="同時抓取的影片數")
+    parser.add_argument("--process-workers", type=int, default=2, help="分類/聚類的行程數")
+    parser.add_argument("--force", action="store_true", help="忽略階段快取，全部重新計算")
+    parser.add_argument(
+        "--fetch-profile", choices=["full", "lean", "pulse"], default="full",
+        help="抓取模式：full 完整、lean 只取需要欄位、pulse 只抓熱門頂層留言"
+    )
+    parser.add_argument("--summary", help="批次摘要輸出路徑（預設 batch_summary_<時間>.csv）")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    video_ids = read_video_ids(args.video_ids, args.file)
 
-    cluster_comments.main(video_id)
\ No newline at end of file
+    if not video_ids:
+        # 沒有給參數時維持原本的互動模式
+        video_id = input("請輸入 YouTube 影片 ID：").strip()
+        results = pipeline.run_pipeline(video_id, force=args.force, fetch_profile=args.fetch_profile)
+        print(f"共存入 {results['fetch']['rows']} 則留言（含回應）")
+    else:
+        results = run_batch(
+            video_ids,
+            fetch_workers=args.fetch_workers,
+            process_workers=args.process_workers,
+            summary_path=args.summary,
+            force=args.force,
+            fetch_profile=args.fetch_profile
+        )
+        if any(r["status"] != "done" for r in results):
+            raise SystemExit(1)
@@ -0,0 +1,198 @@
+import contextvars
+import glob
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# ========= 1. 設定 =========
+TRACE_DIR = "traces"
+SAMPLE_SECONDS = 0.05   # 執行期間取樣常駐記憶體的間隔，用來估計每個 span 的峰值
+
+# 目前執行中的 Run；每個執行緒 / 行程各自獨立，未啟動時所有紀錄都是 no-op
+_current_run = contextvars.ContextVar("perf_trace_run", default=None)
+
+
+def rss_mb():
+    """
+    目前行程的常駐記憶體 (MB)，無法取得時回傳 None
+    （ru_maxrss 是整個行程生命週期的最高值，長駐的 worker 會一直沿用舊峰值，所以不用）
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+# ========= 2. 單次執行的紀錄 =========
+class Run:
+    def __init__(self, name, **meta):
+        self.name = name
+        self.meta = meta
+        self.spans = []
+        self.counters = {}
+        self._stack = []
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self.started_at = time.time()
+        self.peak_rss = rss_mb()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    # 背景取樣：把目前的 RSS 記到這個 run 與所有開啟中的 span
+    def _observe(self, rss):
+        if rss is None:
+            return
+        self.peak_rss = max(self.peak_rss or 0, rss)
+        for record in list(self._stack):
+            record["peak_rss_mb"] = max(record["peak_rss_mb"] or 0, rss)
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_SECONDS):
+            self._observe(rss_mb())
+
+    def start(self):
+        if self.peak_rss is not None and self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    @contextmanager
+    def span(self, name, **fields):
+        parent = self._stack[-1] if self._stack else None
+        record = {
+            "name": name,
+            "parent": parent["name"] if parent else None,
+            "depth": len(self._stack),
+            "offset_s": round(time.perf_counter() - self._start_wall, 4),
+            **fields,
+        }
+        start_rss = rss_mb()
+        record["peak_rss_mb"] = start_rss
+        self._stack.append(record)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = round(time.perf_counter() - start_wall, 4)
+            record["cpu_s"] = round(time.process_time() - start_cpu, 4)
+            end_rss = rss_mb()
+            self._observe(end_rss)
+            # 峰值是 span 期間的取樣最大值；短於取樣間隔的 span 只有開始與結束兩個點
+            record["peak_rss_mb"] = _round(record["peak_rss_mb"])
+            record["rss_mb"] = _round(end_rss)
+            record["rss_delta_mb"] = _round(end_rss - start_rss) if start_rss is not None and end_rss is not None else None
+            self._stack.pop()
+            self.spans.append(record)
+
+    def count(self, key, n=1):
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "meta": self.meta,
+            "started_at": self.started_at,
+            "wall_s": round(time.perf_counter() - self._start_wall, 4),
+            "cpu_s": round(time.process_time() - self._start_cpu, 4),
+            "peak_rss_mb": _round(self.peak_rss),
+            "counters": self.counters,
+            # 依開始時間排序，方便閱讀
+            "spans": sorted(self.spans, key=lambda s: s["offset_s"]),
+        }
+
+    def save(self, path=None):
+        if path is None:
+            # 檔名以 run 名稱開頭，pipeline 與 gemini 等不同種類的紀錄互不混雜
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            label = f"{self.name}_{self.meta['video_id']}" if "video_id" in self.meta else self.name
+            path = os.path.join(TRACE_DIR, f"{label}_{int(self.started_at * 1000)}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return path
+
+
+# ========= 3. 對外介面 =========
+@contextmanager
+def run(name, save=True, **meta):
+    """
+    開始一次執行的紀錄，結束時寫出 JSON trace
+    已經在某個 run 之中時直接沿用外層的 run
+    """
+    outer = _current_run.get()
+    if outer is not None:
+        yield outer
+        return
+
+    current = Run(name, **meta)
+    token = _current_run.set(current)
+    current.start()
+    try:
+        yield current
+    finally:
+        current.stop()
+        _current_run.reset(token)
+        if save:
+            path = current.save()
+            print(f"⏱️ 已輸出效能紀錄：{path}")
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    紀錄一個階段或子步驟的耗時；可在區塊內以 record["items"] = n 補上處理筆數
+    """
+    current = _current_run.get()
+    if current is None:
+        yield dict(fields)
+        return
+    with current.span(name, **fields) as record:
+        yield record
+
+
+def count(key, n=1):
+    """
+    累加計數器，例如 API 呼叫次數或配額
+    """
+    current = _current_run.get()
+    if current is not None:
+        current.count(key, n)
+
+
+def list_traces(video_id, name="pipeline"):
+    """
+    回傳某支影片某種 run（例如 "pipeline"、"gemini"）的 trace 檔案，最新的在前
+    """
+    # video_id 可能含底線，只接受 <name>_<video_id>_<毫秒>.json
+    pattern = re.compile(rf"{re.escape(name)}_{re.escape(video_id)}_\d+\.json")
+    paths = [
+        p for p in glob.glob(os.path.join(TRACE_DIR, f"{name}_*.json"))
+        if pattern.fullmatch(os.path.basename(p))
+    ]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def load_trace(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
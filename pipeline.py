@@ -0,0 +1,267 @@
+import glob
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+import artifacts
+import getYTComments
+import classify_comments
+import cluster_comments
+import perf_trace
+import comment_store
+import rollups
+
+# ========= 1. 流程階段 =========
+# 抓取 → 情緒分類 → 語意聚類 → 時間彙總，依序執行
+STAGES = ["fetch", "classify", "cluster", "rollup"]
+
+# 各階段的預設參數（會一併納入快取指紋）
+CLASSIFY_PARAMS = {"pos_th": 2, "neg_th": -2}
+CLUSTER_PARAMS = {
+    "min_len": 3,
+    "k_min": 2,
+    "k_max": 10,
+    "model_name": cluster_comments.MODEL_NAME,
+}
+
+CLASSIFY_COLUMNS = ["sentiment_score", "sentiment", "is_question"]
+CLUSTER_COLUMNS = ["cluster"]
+
+# 以指紋為檔名的階段結果快取，放在 artifacts/<video_id>/stage_cache/
+# 直播或持續有新留言的影片每次抓取指紋都不同，每個階段只保留最近用過的幾組
+CACHE_DIR = "stage_cache"
+CACHE_KEEP = 3
+HASH_CHUNKSIZE = 100_000
+
+
+# ========= 2. 指紋 =========
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def comment_data_hash(video_id):
+    """
+    只對抓取下來的 comment_id 與 text 計算雜湊，
+    分類/聚類寫回的欄位不影響指紋；分塊讀取，記憶體只和 HASH_CHUNKSIZE 有關
+    """
+    reader = pd.read_csv(
+        comment_store.comments_path(video_id),
+        usecols=["comment_id", "text"],
+        dtype=str,
+        keep_default_na=False,
+        chunksize=HASH_CHUNKSIZE
+    )
+    h = hashlib.sha256()
+    with reader:
+        for chunk in reader:
+            for cid, text in zip(chunk["comment_id"], chunk["text"]):
+                h.update(f"{cid}\x1f{text}\x1e".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _fingerprint(stage, parts):
+    payload = json.dumps({"stage": stage, **parts}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def classify_fingerprint(data_hash, params):
+    return _fingerprint("classify", {
+        "data": data_hash,
+        "positive_lexicon": file_hash(classify_comments.POSITIVE_PATH),
+        "negative_lexicon": file_hash(classify_comments.NEGATIVE_PATH),
+        "question_words": classify_comments.QUESTION_WORDS,
+        "question_punct": classify_comments.QUESTION_PUNCT,
+        "params": params,
+    })
+
+
+def cluster_fingerprint(data_hash, params):
+    return _fingerprint("cluster", {
+        "data": data_hash,
+        "params": params,
+    })
+
+
+# ========= 3. 快取讀寫 =========
+def _cache_path(video_id, stage, fp, suffix=""):
+    return artifacts.path(video_id, os.path.join(CACHE_DIR, f"{stage}_{fp}{suffix}.csv"))
+
+
+def _cache_hit(video_id, stage, fp, suffixes=("",)):
+    """
+    快取是否齊全；命中時更新檔案時間，讓最近用過的指紋不會被清掉
+    """
+    paths = [_cache_path(video_id, stage, fp, suffix) for suffix in suffixes]
+    if not all(os.path.exists(p) for p in paths):
+        return False
+    for p in paths:
+        os.utime(p)
+    return True
+
+
+def _prune_cache(video_id, stage, keep=CACHE_KEEP):
+    """
+    每個階段只保留最近使用的 keep 組指紋（同一組指紋可能有多個檔案，例如聚類的關鍵字）
+    """
+    groups = {}
+    for p in glob.glob(_cache_path(video_id, stage, "*")):
+        fp = os.path.basename(p)[len(stage) + 1:].split("_")[0].split(".")[0]
+        groups.setdefault(fp, []).append(p)
+    ordered = sorted(groups.values(), key=lambda files: max(os.path.getmtime(f) for f in files), reverse=True)
+    for files in ordered[keep:]:
+        for f in files:
+            os.remove(f)
+
+
+def _store_columns(video_id, stage, fp, columns):
+    df = pd.read_csv(comment_store.comments_path(video_id), usecols=["comment_id"] + columns)
+    with artifacts.atomic_write(_cache_path(video_id, stage, fp)) as tmp_path:
+        df.drop_duplicates("comment_id").to_csv(tmp_path, index=False, encoding="utf-8-sig")
+
+
+def _restore_columns(video_id, stage, fp, columns):
+    """
+    把快取的欄位合併回留言檔；由呼叫端登記到 manifest
+    """
+    cached = pd.read_csv(_cache_path(video_id, stage, fp), dtype={"comment_id": str})
+    filename = comment_store.comments_path(video_id)
+    df = comment_store.load_comments(filename)
+    df = df.drop(columns=[c for c in columns if c in df.columns])
+    df = df.merge(cached, on="comment_id", how="left")
+    classify_comments.safe_write_csv(df, filename)
+    return filename
+
+
+# ========= 4. 各階段 =========
+def run_fetch(video_id, force=False, profile="full", requested_at=None):
+    """
+    參數:
+        requested_at: 這次執行送出的時間；等待期間其他執行已用相同模式抓取過時直接沿用
+    """
+    filename = comment_store.comments_path(video_id)
+    entry = artifacts.snapshot(video_id)["artifacts"].get(os.path.basename(filename))
+    if (
+        not force and requested_at is not None and entry is not None
+        and entry.get("fetched_at", 0) >= requested_at and entry.get("profile") == profile
+    ):
+        print(f"♻️ [{video_id}] 其他執行剛抓取過留言，直接沿用")
+        return {"reused": True, "rows": entry.get("rows", 0), "csv_file": filename, "fetch_stats": entry.get("stats")}
+
+    stats = {}
+    rows = getYTComments.get_all_comments(video_id, profile=profile, stats=stats)
+    saved_filename = getYTComments.save_to_csv(video_id, rows, profile=profile, stats=stats)
+    return {"rows": len(rows), "csv_file": saved_filename, "fetch_stats": stats}
+
+
+def run_classify(video_id, force=False, params=None):
+    params = {**CLASSIFY_PARAMS, **(params or {})}
+    fp = classify_fingerprint(comment_data_hash(video_id), params)
+
+    if not force and _cache_hit(video_id, "classify", fp):
+        artifacts.record(video_id, _restore_columns(video_id, "classify", fp, CLASSIFY_COLUMNS))
+        return {"reused": True, "fingerprint": fp}
+
+    classify_comments.main(video_id, **params)
+    _store_columns(video_id, "classify", fp, CLASSIFY_COLUMNS)
+    _prune_cache(video_id, "classify")
+    return {"reused": False, "fingerprint": fp}
+
+
+def run_cluster(video_id, force=False, params=None):
+    params = {**CLUSTER_PARAMS, **(params or {})}
+    fp = cluster_fingerprint(comment_data_hash(video_id), params)
+    keywords_cache = _cache_path(video_id, "cluster", fp, "_keywords")
+
+    if not force and _cache_hit(video_id, "cluster", fp, suffixes=("", "_keywords")):
+        filename = _restore_columns(video_id, "cluster", fp, CLUSTER_COLUMNS)
+        kw_df = pd.read_csv(keywords_cache, dtype={"video_id": str})
+        cluster_comments.safe_write_csv(kw_df, cluster_comments.keywords_path(video_id))
+        artifacts.record_many(video_id, {filename: {}, cluster_comments.keywords_path(video_id): {}})
+        return {"reused": True, "fingerprint": fp}
+
+    # 直接使用 main 回傳的關鍵字，不再讀回共用檔案（其他執行可能已經覆寫）
+    kw_df = cluster_comments.main(video_id, **params)
+    _store_columns(video_id, "cluster", fp, CLUSTER_COLUMNS)
+    with artifacts.atomic_write(keywords_cache) as tmp_path:
+        kw_df.to_csv(tmp_path, index=False, encoding="utf-8-sig")
+    _prune_cache(video_id, "cluster")
+    return {"reused": False, "fingerprint": fp}
+
+
+def run_rollup(video_id, force=False):
+    # 彙總表本身就是增量更新，只有留言或分類結果變動的部分會重算
+    if force:
+        artifacts.forget(video_id, rollups.rollup_path(video_id))
+    df = comment_store.load_comments(
+        comment_store.comments_path(video_id),
+        columns=lambda c: c in ("comment_id", "publishedAt", "sentiment", "cluster", "is_question")
+    )
+    changed = rollups.build_or_update(video_id, df)
+    return {"reused": changed == 0, "changed": changed}
+
+
+STAGE_FUNCS = {
+    "fetch": run_fetch,
+    "classify": run_classify,
+    "cluster": run_cluster,
+    "rollup": run_rollup,
+}
+
+
+def run_pipeline(video_id, stages=None, on_stage=None, force=False, fetch_profile="full"):
+    """
+    依序執行指定的階段；分類與聚類的輸入指紋與快取相同時直接沿用結果。
+    同一支影片同時只有一個執行會寫入產出檔，後到的執行等待後沿用前者的結果
+
+    參數:
+        video_id: YouTube 影片 ID
+        stages: 要執行的階段列表，預設為全部 (STAGES)
+        on_stage: 回呼函數 on_stage(stage, state, info)，
+                  state 為 "running" / "done"，用來回報進度
+        force: True 時忽略快取，全部重新計算
+        fetch_profile: 抓取模式，見 getYTComments.FETCH_PROFILES
+    回傳:
+        dict，各階段回傳的資訊，另含 "report"：{階段: "ran" 或 "reused"}
+             與 "manifest_version"：完成時的產出檔版本
+    """
+    stages = stages or STAGES
+    results = {}
+    report = {}
+    requested_at = time.time()
+
+    with perf_trace.run("pipeline", video_id=video_id, stages=list(stages), force=force, fetch_profile=fetch_profile), \
+            artifacts.video_lock(video_id):
+        artifacts.migrate_legacy(video_id, lock_timeout=None)
+        for stage in stages:
+            if on_stage:
+                on_stage(stage, "running", {})
+
+            with perf_trace.span(f"stage.{stage}") as record:
+                options = {"profile": fetch_profile, "requested_at": requested_at} if stage == "fetch" else {}
+                info = STAGE_FUNCS[stage](video_id, force=force, **options)
+                record["reused"] = bool(info.get("reused"))
+            results[stage] = info
+            report[stage] = "reused" if info.get("reused") else "ran"
+
+            if on_stage:
+                on_stage(stage, "done", info)
+
+    results["report"] = report
+    results["manifest_version"] = artifacts.snapshot(video_id)["version"]
+    print("階段執行報告：" + "，".join(
+        f"{stage} {'♻️ 沿用快取' if state == 'reused' else '▶️ 已執行'}"
+        for stage, state in report.items()
+    ))
+    return results
+
+
+if __name__ == "__main__":
+    video_id = input("請輸入 YouTube 影片 ID：").strip()
+    run_pipeline(video_id)
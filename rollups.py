@@ -0,0 +1,206 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import artifacts
+import perf_trace
+
+# ========= 1. 設定 =========
+SENTIMENTS = ["positive", "neutral", "negative"]
+GRANULARITIES = ["hour", "day", "week"]
+KEY_COLUMNS = ["hour", "sentiment", "cluster", "is_question"]
+NO_CLUSTER = -1
+NO_SENTIMENT = -1
+
+
+def rollup_path(video_id):
+    return artifacts.path(video_id, "rollups.npz")
+
+
+def comment_keys(df):
+    """
+    每則留言對應的彙總鍵：小時桶（自 1970 起的小時數）、情緒代碼、聚類、是否為問題
+    發佈時間缺值（NaT）的留言無法分桶，不計入彙總
+    """
+    df = df.drop_duplicates("comment_id")
+    published = pd.to_datetime(df["publishedAt"], errors="coerce", utc=True)
+    df = df[published.notna().to_numpy()]
+    published = (
+        published.dropna().dt.tz_localize(None)
+        .to_numpy(dtype="datetime64[ns]").astype("datetime64[h]").astype(np.int64)
+    )
+
+    if "sentiment" in df.columns:
+        sentiment = pd.Categorical(df["sentiment"].astype(str), categories=SENTIMENTS).codes
+    else:
+        sentiment = np.full(len(df), NO_SENTIMENT)
+
+    if "cluster" in df.columns:
+        cluster = pd.to_numeric(df["cluster"], errors="coerce").fillna(NO_CLUSTER).to_numpy()
+    else:
+        cluster = np.full(len(df), NO_CLUSTER)
+
+    if "is_question" in df.columns:
+        is_question = df["is_question"].to_numpy(dtype=bool)
+    else:
+        is_question = np.zeros(len(df), dtype=bool)
+
+    return pd.DataFrame({
+        "comment_id": df["comment_id"].astype(str).to_numpy(),
+        "hour": published,
+        "sentiment": sentiment.astype(np.int8),
+        "cluster": cluster.astype(np.int16),
+        "is_question": is_question,
+    })
+
+
+def _count(keys):
+    if len(keys) == 0:
+        return pd.Series(dtype=np.int64, index=pd.MultiIndex.from_arrays([[]] * 4, names=KEY_COLUMNS))
+    return keys.groupby(KEY_COLUMNS).size()
+
+
+# ========= 2. 彙總表 =========
+class Rollups:
+    """
+    hourly：每個 (小時, 情緒, 聚類, 是否問題) 的留言數，天/週由小時表向上彙總
+    ledger：已計入的留言及其彙總鍵，用來計算新增或變動留言的增量
+    """
+
+    def __init__(self, ledger, hourly):
+        self.ledger = ledger
+        self.hourly = hourly
+
+    @classmethod
+    def build(cls, df):
+        ledger = comment_keys(df)
+        return cls(ledger, _count(ledger.drop(columns="comment_id")))
+
+    def update(self, df):
+        """
+        只對新增、刪除或彙總鍵有變的留言做 ±1 增量
+
+        回傳:
+            變動的留言數
+        """
+        new = comment_keys(df)
+        merged = new.merge(self.ledger, on="comment_id", how="outer", suffixes=("", "_old"), indicator=True)
+
+        same = (merged["_merge"] == "both") & np.logical_and.reduce([
+            merged[c] == merged[f"{c}_old"] for c in KEY_COLUMNS
+        ])
+        changed = merged[~same]
+        if len(changed) == 0:
+            return 0
+
+        added = changed[changed["_merge"] != "right_only"][KEY_COLUMNS].astype(new[KEY_COLUMNS].dtypes)
+        removed = changed[changed["_merge"] != "left_only"][[f"{c}_old" for c in KEY_COLUMNS]]
+        removed.columns = KEY_COLUMNS
+        removed = removed.astype(new[KEY_COLUMNS].dtypes)
+
+        delta = _count(added).sub(_count(removed), fill_value=0)
+        hourly = self.hourly.add(delta, fill_value=0)
+        self.hourly = hourly[hourly > 0].astype(np.int64)
+        self.ledger = new
+        return len(changed)
+
+    def table(self, granularity="hour"):
+        """
+        回傳某個時間粒度的彙總表：bucket（UTC 時間）、sentiment、cluster、is_question、count
+        """
+        counts = self.hourly.reset_index(name="count")
+        hours = counts["hour"].astype(np.int64)
+        if granularity == "day":
+            counts["hour"] = (hours // 24) * 24
+        elif granularity == "week":
+            # 1970-01-01 是星期四，+3 天後以星期一為一週的開始
+            counts["hour"] = ((hours // 24 + 3) // 7 * 7 - 3) * 24
+        table = counts.groupby(KEY_COLUMNS, as_index=False)["count"].sum()
+
+        table.insert(0, "bucket", pd.to_datetime(table.pop("hour"), unit="h", utc=True))
+        # 代碼 -1（尚未分類）會成為缺值
+        table["sentiment"] = pd.Categorical.from_codes(table["sentiment"].astype(int), categories=SENTIMENTS)
+        return table
+
+    # ========= 3. 儲存 / 載入 =========
+    def save(self, path):
+        hourly = self.hourly.reset_index(name="count")
+        arrays = {f"ledger_{c}": self.ledger[c].to_numpy() for c in KEY_COLUMNS}
+        # 留言 ID 存成固定長度字串，讀取時不需要 allow_pickle
+        arrays["ledger_comment_id"] = np.asarray(self.ledger["comment_id"], dtype=str)
+        arrays.update({f"hourly_{c}": hourly[c].to_numpy() for c in hourly.columns})
+        # 天/週的彙總一併存檔，圖表只需要讀小表
+        for granularity in ["day", "week"]:
+            table = self.table(granularity)
+            arrays[f"{granularity}_bucket"] = (
+                table["bucket"].to_numpy(dtype="datetime64[ns]").astype("datetime64[h]").astype(np.int64)
+            )
+            for c in ["sentiment", "cluster", "is_question", "count"]:
+                values = table[c].cat.codes if c == "sentiment" else table[c]
+                arrays[f"{granularity}_{c}"] = values.to_numpy()
+        with artifacts.atomic_write(path) as tmp_path:
+            np.savez_compressed(tmp_path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as f:
+            ledger = pd.DataFrame({
+                c: f[f"ledger_{c}"] for c in ["comment_id"] + KEY_COLUMNS
+            })
+            hourly = _load_hourly(f)
+        return cls(ledger, hourly)
+
+
+def _load_hourly(f):
+    hourly = pd.DataFrame({c: f[f"hourly_{c}"] for c in KEY_COLUMNS + ["count"]})
+    return hourly.set_index(KEY_COLUMNS)["count"]
+
+
+def load_table(video_id, granularity="hour", path=None):
+    """
+    只讀取圖表需要的彙總表，不需要原始留言
+
+    參數:
+        path: 指定要讀的檔案（例如 manifest 快照中的版本檔），預設為最新的彙總表
+    """
+    path = path or rollup_path(video_id)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        if granularity == "hour":
+            # 小時表不需要載入 ledger
+            return Rollups(None, _load_hourly(f)).table("hour")
+
+        table = pd.DataFrame({
+            "bucket": pd.to_datetime(f[f"{granularity}_bucket"].astype(np.int64), unit="h", utc=True),
+            "sentiment": pd.Categorical.from_codes(f[f"{granularity}_sentiment"], categories=SENTIMENTS),
+            "cluster": f[f"{granularity}_cluster"],
+            "is_question": f[f"{granularity}_is_question"],
+            "count": f[f"{granularity}_count"],
+        })
+    return table
+
+
+def build_or_update(video_id, df):
+    """
+    依最新的留言增量更新彙總表；回傳變動的留言數
+    """
+    path = rollup_path(video_id)
+    rollups = Rollups.load(path)
+
+    with perf_trace.span("rollup.update", items=len(df)) as record:
+        if rollups is None:
+            rollups = Rollups.build(df)
+            changed = len(rollups.ledger)
+        else:
+            changed = rollups.update(df)
+        record["changed"] = changed
+
+    if changed or not os.path.exists(path):
+        rollups.save(path)
+        artifacts.record(video_id, path)
+        print(f"✅ 時間彙總已更新：{changed} 則留言變動，共 {len(rollups.hourly)} 個小時桶")
+    return changed
@@ -0,0 +1,213 @@
+import pickle
+import re
+import time
+from array import array
+
+import jieba
+import numpy as np
+
+import artifacts
+import perf_trace
+
+# ========= 1. 設定 =========
+INDEX_VERSION = 2
+NGRAM_PREFIX = "\x01"  # 與 jieba 詞彙區隔的字元 n-gram 前綴
+NGRAM_N = 2
+COMPACT_RATIO = 0.25   # 已刪除或改寫的文件超過這個比例時重建索引
+
+
+def index_path(video_id):
+    return artifacts.path(video_id, "search_index.pkl")
+
+
+def char_ngrams(text, n=NGRAM_N):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def doc_terms(text):
+    """
+    一則留言的索引詞：jieba 斷詞 + 字元 bigram（處理未收錄的詞）+ 單字（單一字元查詢）
+    """
+    words = {w for w in jieba.lcut(text) if w.strip()}
+    grams = {NGRAM_PREFIX + g for g in char_ngrams(text) | char_ngrams(text, 1) if g.strip()}
+    return words | grams
+
+
+# ========= 2. 倒排索引 =========
+class SearchIndex:
+    def __init__(self):
+        self.version = INDEX_VERSION
+        self.comment_ids = []   # 文件編號 → comment_id（已刪除或改寫的舊文件為 None）
+        self.texts = []         # 文件編號 → 小寫留言，用來驗證子字串與偵測改寫
+        self.doc_of = {}        # comment_id → 文件編號
+        self.postings = {}      # 詞 → array('I') 遞增的文件編號
+        self.dead = 0           # 已失效的文件數
+
+    def __len__(self):
+        return len(self.doc_of)
+
+    def add(self, comment_ids, texts):
+        """
+        加入尚未索引的留言，回傳新增的數量
+        """
+        added = 0
+        for cid, text in zip(comment_ids, texts):
+            if cid in self.doc_of:
+                continue
+            doc = len(self.comment_ids)
+            text = str(text).lower()
+            self.comment_ids.append(cid)
+            self.texts.append(text)
+            self.doc_of[cid] = doc
+            for term in doc_terms(text):
+                self.postings.setdefault(term, array("I")).append(doc)
+            added += 1
+        return added
+
+    def _remove(self, cid):
+        # postings 只會遞增附加，舊文件留在 postings 中，查詢結果再濾掉
+        doc = self.doc_of.pop(cid)
+        self.comment_ids[doc] = None
+        self.texts[doc] = ""
+        self.dead += 1
+
+    def sync(self, comment_ids, texts):
+        """
+        讓索引與目前的留言一致：新增的留言加入；內容改變的留言重新索引；
+        不在列表中的留言（已刪除）移除。失效文件太多時整個重建
+
+        回傳:
+            新增、改寫與刪除的留言數
+        """
+        current = {}
+        for cid, text in zip(comment_ids, texts):
+            current.setdefault(cid, str(text).lower())
+
+        removed = [cid for cid in self.doc_of if cid not in current]
+        edited = [
+            cid for cid, text in current.items()
+            if cid in self.doc_of and self.texts[self.doc_of[cid]] != text
+        ]
+        for cid in removed + edited:
+            self._remove(cid)
+        added = self.add(current.keys(), current.values())
+
+        if self.dead > COMPACT_RATIO * len(self.comment_ids):
+            # 清空後重建，丟掉 postings 中的失效文件
+            self.__init__()
+            self.add(current.keys(), current.values())
+        return added + len(removed)
+
+    def _docs(self, term):
+        posting = self.postings.get(term)
+        if posting is None:
+            return np.empty(0, dtype=np.uint32)
+        return np.frombuffer(posting, dtype=np.uint32)
+
+    def _intersect(self, arrays):
+        arrays = sorted(arrays, key=len)
+        result = arrays[0]
+        for other in arrays[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, other, assume_unique=True)
+        return result
+
+    def term_docs(self, term):
+        """
+        單一查詢詞 → 符合的文件編號
+        斷詞結果含該詞的留言直接命中；其餘用 bigram 交集縮小範圍，再以子字串確認
+        """
+        term = term.lower().strip()
+        if not term:
+            return np.empty(0, dtype=np.uint32)
+        if len(term) == 1:
+            # 單一字元有自己的 postings，出現即符合
+            return self._docs(NGRAM_PREFIX + term)
+
+        # 斷詞時被切成同一個詞的留言一定符合，不需再驗證
+        exact = self._docs(term)
+
+        candidates = self._intersect([self._docs(NGRAM_PREFIX + g) for g in char_ngrams(term)])
+        candidates = np.setdiff1d(candidates, exact, assume_unique=True)
+
+        matched = np.fromiter(
+            (d for d in candidates if term in self.texts[d]),
+            dtype=np.uint32
+        )
+        return np.union1d(matched, exact)
+
+    def search(self, query):
+        """
+        布林查詢：空白或 AND 表示「且」，OR 或 | 表示「或」（AND 優先，運算子不分大小寫）
+        例如：`電池 續航 OR 充電` = (電池 AND 續航) OR 充電
+
+        回傳:
+            set，符合的 comment_id
+        """
+        query = query.strip()
+        if not query:
+            return set()
+
+        result = np.empty(0, dtype=np.uint32)
+        for group in re.split(r"\s+OR\s+|\|", query, flags=re.IGNORECASE):
+            terms = [t for t in re.split(r"\s+AND\s+|\s+|&", group.strip(), flags=re.IGNORECASE) if t]
+            if not terms:
+                continue
+            docs = self._intersect([self.term_docs(t) for t in terms])
+            result = np.union1d(result, docs)
+
+        return {self.comment_ids[d] for d in result if self.comment_ids[d] is not None}
+
+    # ========= 3. 儲存 / 載入 =========
+    def save(self, path):
+        with artifacts.atomic_write(path) as tmp_path, open(tmp_path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path, "rb") as f:
+                index = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        if getattr(index, "version", None) != INDEX_VERSION:
+            return None
+        return index
+
+
+def build_or_update(video_id, df, save=True):
+    """
+    載入影片的搜尋索引並與目前的留言同步（新增、改寫、刪除），有變動才寫回檔案
+
+    參數:
+        save: False 時只在記憶體更新（沒有取得影片鎖時使用）
+    """
+    path = index_path(video_id)
+    index = SearchIndex.load(path) or SearchIndex()
+
+    with perf_trace.span("search_index.update") as record:
+        start = time.perf_counter()
+        changed = index.sync(df["comment_id"].tolist(), df["text"].astype(str).tolist())
+        record["items"] = changed
+
+    if changed and save:
+        index.save(path)
+        artifacts.record(video_id, path)
+        print(f"✅ 搜尋索引更新 {changed} 則（共 {len(index)} 則），耗時 {time.perf_counter() - start:.2f} 秒")
+    return index
+
+
+if __name__ == "__main__":
+    import comment_store
+
+    video_id = input("請輸入 YouTube 影片 ID：").strip()
+    df = comment_store.load_comments(comment_store.comments_path(video_id), columns=["comment_id", "text"])
+    index = build_or_update(video_id, df)
+    while True:
+        query = input("搜尋（空白離開）：").strip()
+        if not query:
+            break
+        start = time.perf_counter()
+        ids = index.search(query)
+        print(f"找到 {len(ids)} 則，耗時 {(time.perf_counter() - start) * 1000:.1f} ms")
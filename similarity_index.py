@@ -0,0 +1,181 @@
+import math
+import os
+
+import numpy as np
+
+import artifacts
+import perf_trace
+
+# ========= 1. 設定 =========
+EXACT_LIMIT = 50_000     # 留言數不超過這個值時用精確搜尋，超過改用 IVF 近似索引
+BLOCK_SIZE = 65_536      # 精確搜尋每次相乘的列數，避免一次載入整個矩陣
+IVF_SAMPLE = 100_000     # 訓練 IVF 中心點時最多抽樣的筆數
+IVF_NPROBE = 8           # 查詢時探訪的最近中心點數量
+
+
+def embeddings_path(video_id):
+    return artifacts.path(video_id, "embeddings.npy")
+
+
+def index_path(video_id):
+    return artifacts.path(video_id, "similarity.npz")
+
+
+# ========= 2. 儲存向量 =========
+def save_embeddings(video_id, comment_ids, embeddings, model_name):
+    """
+    保存正規化後的向量並建立最近鄰索引（cluster_comments.main 會呼叫）
+    """
+    vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+    with artifacts.atomic_write(embeddings_path(video_id)) as tmp_path:
+        np.save(tmp_path, vectors)
+
+    with perf_trace.span("similarity.build_index", items=len(vectors)) as record:
+        ivf = build_ivf(vectors) if len(vectors) > EXACT_LIMIT else None
+        record["mode"] = "ivf" if ivf else "exact"
+
+    extra = {}
+    if ivf is not None:
+        extra = {"centroids": ivf[0], "offsets": ivf[1], "members": ivf[2]}
+    with artifacts.atomic_write(index_path(video_id)) as tmp_path:
+        np.savez(
+            tmp_path,
+            comment_ids=np.asarray(comment_ids, dtype=str),
+            model_name=np.array(model_name),
+            **extra
+        )
+    # 向量與索引以同一個版本登記，索引的列號永遠對應同一份向量
+    artifacts.record_many(video_id, {
+        embeddings_path(video_id): {"rows": len(vectors)},
+        index_path(video_id): {"mode": "ivf" if ivf else "exact"},
+    })
+    print(f"✅ 已儲存語意向量與索引：{embeddings_path(video_id)}（{'IVF' if ivf else '精確'}）")
+
+
+def _nearest_centroid(vectors, centroids):
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), BLOCK_SIZE):
+        block = np.asarray(vectors[start:start + BLOCK_SIZE])
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def build_ivf(vectors, seed=42):
+    """
+    倒排檔 (IVF)：以 MiniBatchKMeans 分成約 4√n 個列表，每個向量放進最近的中心點
+
+    回傳:
+        (centroids, offsets, members)，第 i 個列表的成員為 members[offsets[i]:offsets[i+1]]
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    n = len(vectors)
+    n_lists = min(int(4 * math.sqrt(n)), 4096)
+
+    rng = np.random.default_rng(seed)
+    sample_idx = np.sort(rng.choice(n, size=min(n, IVF_SAMPLE), replace=False))
+    kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=seed, n_init=1, batch_size=4096)
+    kmeans.fit(np.asarray(vectors[sample_idx]))
+
+    centroids = kmeans.cluster_centers_.astype(np.float32)
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    labels = _nearest_centroid(vectors, centroids)
+    members = np.argsort(labels, kind="stable").astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))]).astype(np.int64)
+    return centroids, offsets, members
+
+
+# ========= 3. 查詢 =========
+def _top_k(scores, rows, top_k):
+    if len(scores) > top_k:
+        part = np.argpartition(-scores, top_k)[:top_k]
+        scores, rows = scores[part], rows[part]
+    order = np.argsort(-scores)
+    return scores[order], rows[order]
+
+
+class NearestNeighborIndex:
+    def __init__(self, vectors, comment_ids, model_name, ivf=None):
+        self.vectors = vectors
+        self.comment_ids = comment_ids
+        self.model_name = model_name
+        self.ivf = ivf
+        self.row_of = {cid: i for i, cid in enumerate(comment_ids)}
+
+    @classmethod
+    def load(cls, video_id, manifest=None):
+        """
+        參數:
+            manifest: artifacts.snapshot 的快照；指定時讀取快照中的版本檔
+        """
+        vectors_file, index_file = embeddings_path(video_id), index_path(video_id)
+        if manifest is not None:
+            vectors_file = artifacts.resolve(video_id, manifest, os.path.basename(vectors_file))
+            index_file = artifacts.resolve(video_id, manifest, os.path.basename(index_file))
+        if not (vectors_file and index_file and os.path.exists(vectors_file) and os.path.exists(index_file)):
+            return None
+        vectors = np.load(vectors_file, mmap_mode="r")
+        with np.load(index_file) as f:
+            comment_ids = f["comment_ids"].tolist()
+            model_name = str(f["model_name"])
+            ivf = (f["centroids"], f["offsets"], f["members"]) if "centroids" in f.files else None
+        return cls(vectors, comment_ids, model_name, ivf)
+
+    def __len__(self):
+        return len(self.comment_ids)
+
+    def _search_exact(self, query, top_k):
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, len(self.vectors), BLOCK_SIZE):
+            block = np.asarray(self.vectors[start:start + BLOCK_SIZE])
+            scores = block @ query
+            rows = np.arange(start, start + len(block))
+            best_scores, best_rows = _top_k(
+                np.concatenate([best_scores, scores]),
+                np.concatenate([best_rows, rows]),
+                top_k
+            )
+        return best_scores, best_rows
+
+    def _search_ivf(self, query, top_k, nprobe):
+        centroids, offsets, members = self.ivf
+        probe = np.argsort(-(centroids @ query))[:nprobe]
+        rows = np.sort(np.concatenate([members[offsets[c]:offsets[c + 1]] for c in probe]))
+        scores = np.asarray(self.vectors[rows]) @ query
+        return _top_k(scores, rows, top_k)
+
+    def search_vector(self, query, top_k=10, exclude=None, nprobe=IVF_NPROBE):
+        """
+        以正規化向量查詢，回傳 [(comment_id, 相似度), ...]（由高到低）
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        extra = 1 if exclude is not None else 0
+        if self.ivf is None:
+            scores, rows = self._search_exact(query, top_k + extra)
+        else:
+            scores, rows = self._search_ivf(query, top_k + extra, nprobe)
+
+        results = [
+            (self.comment_ids[r], float(s))
+            for s, r in zip(scores, rows)
+            if self.comment_ids[r] != exclude
+        ]
+        return results[:top_k]
+
+    def similar_to(self, comment_id, top_k=10):
+        """
+        找出與某則留言最相似的留言（不含自己）
+        """
+        row = self.row_of.get(comment_id)
+        if row is None:
+            return []
+        return self.search_vector(self.vectors[row], top_k=top_k, exclude=comment_id)
+
+    def search_text(self, text, model, top_k=10):
+        """
+        自由文字語意搜尋；model 必須與建立向量時相同（self.model_name）
+        """
+        query = model.encode([text], normalize_embeddings=True)[0]
+        return self.search_vector(query, top_k=top_k)
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# 模組都放在專案根目錄（扁平結構）
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+
+@pytest.fixture
+def video(tmp_path, monkeypatch):
+    """
+    產出檔以相對路徑寫入 artifacts/<video_id>/，切到暫存目錄讓每個測試各自一份
+    """
+    monkeypatch.chdir(tmp_path)
+    return "vid"
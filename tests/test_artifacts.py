@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import artifacts
+
+
+def _write(target, text):
+    with artifacts.atomic_write(target) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def _read(target):
+    with open(target, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_atomic_write_replaces_target(video):
+    target = artifacts.path(video, "a.txt")
+    _write(target, "old")
+    _write(target, "new")
+    assert _read(target) == "new"
+    assert os.listdir(artifacts.video_dir(video)) == ["a.txt"]
+
+
+def test_atomic_write_keeps_old_file_on_error(video):
+    target = artifacts.path(video, "a.txt")
+    _write(target, "old")
+    with pytest.raises(RuntimeError):
+        with artifacts.atomic_write(target) as tmp_path:
+            with open(tmp_path, "w") as f:
+                f.write("partial")
+            raise RuntimeError("boom")
+    assert _read(target) == "old"
+    assert os.listdir(artifacts.video_dir(video)) == ["a.txt"]
+
+
+def test_record_pins_version_for_snapshot_readers(video):
+    target = artifacts.path(video, "comments.csv")
+    _write(target, "v1")
+    artifacts.record(video, target, rows=1)
+    manifest = artifacts.snapshot(video)
+
+    _write(target, "v2")
+    artifacts.record(video, target)
+
+    assert _read(artifacts.resolve(video, manifest, "comments.csv")) == "v1"
+    latest = artifacts.snapshot(video)
+    assert _read(artifacts.resolve(video, latest, "comments.csv")) == "v2"
+    assert latest["artifacts"]["comments.csv"]["rows"] == 1
+    assert artifacts.resolve(video, latest, "missing.csv") is None
+
+
+def test_record_many_shares_one_version(video):
+    comments = artifacts.path(video, "comments.csv")
+    keywords = artifacts.path(video, "cluster_keywords.csv")
+    _write(comments, "c")
+    _write(keywords, "k")
+
+    version = artifacts.record_many(video, {comments: {}, keywords: {"clusters": 3}})
+    manifest = artifacts.snapshot(video)
+    assert manifest["version"] == version == 1
+    assert artifacts.version_of(manifest, "comments.csv") == artifacts.version_of(manifest, "cluster_keywords.csv")
+
+
+def test_old_versions_are_pruned(video):
+    target = artifacts.path(video, "rollups.npz")
+    for i in range(artifacts.KEEP_VERSIONS + 2):
+        _write(target, str(i))
+        artifacts.record(video, target)
+    assert len(artifacts._versions(target)) == artifacts.KEEP_VERSIONS
+
+    artifacts.forget(video, target)
+    assert artifacts._versions(target) == []
+    assert not os.path.exists(target)
+    assert artifacts.version_of(artifacts.snapshot(video), "rollups.npz") is None
+
+
+def test_stale_lock_is_broken_once(video, monkeypatch):
+    monkeypatch.setattr(artifacts, "LOCK_STALE_SECONDS", 0.2)
+    lock_path = artifacts.path(video, ".lock")
+    os.makedirs(os.path.dirname(lock_path))
+    with open(lock_path, "w") as f:
+        f.write("dead")
+    past = time.time() - 10
+    os.utime(lock_path, (past, past))
+
+    holders = []
+    active = []
+
+    def worker(name):
+        with artifacts.file_lock(lock_path, timeout=5):
+            active.append(name)
+            holders.append(len(active))
+            time.sleep(0.05)
+            active.remove(name)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert holders == [1, 1, 1, 1]
+
+
+def test_fresh_lock_is_not_broken(video):
+    lock_path = artifacts.path(video, ".lock")
+    with artifacts.file_lock(lock_path):
+        assert not artifacts._break_stale(lock_path)
+        with pytest.raises(TimeoutError):
+            with artifacts.file_lock(lock_path, timeout=0.1):
+                pass
+
+
+def test_migrate_legacy_files(video):
+    with open(f"comments_{video}.csv", "w", encoding="utf-8") as f:
+        f.write("comment_id,text\na,hi\n")
+    pd.DataFrame({
+        "video_id": [video, "other"],
+        "cluster_n": [0, 0],
+        "cluster_keywords": ["mine", "theirs"],
+    }).to_csv("cluster_keywords.csv", index=False)
+
+    migrated = artifacts.migrate_legacy(video)
+    assert sorted(migrated) == ["cluster_keywords.csv", "comments.csv"]
+    assert not os.path.exists(f"comments_{video}.csv")
+    # 共用的舊關鍵字檔保留給其他影片
+    assert os.path.exists("cluster_keywords.csv")
+
+    manifest = artifacts.snapshot(video)
+    kw_df = pd.read_csv(artifacts.resolve(video, manifest, "cluster_keywords.csv"))
+    assert kw_df["cluster_keywords"].tolist() == ["mine"]
+    assert _read(artifacts.resolve(video, manifest, "comments.csv")).startswith("comment_id")
+    assert artifacts.migrate_legacy(video) == []
+
+
+def test_migrate_legacy_checks_only_once(video, monkeypatch):
+    # 共用關鍵字檔沒有這支影片的列：第一次檢查後標記，之後不再取鎖或讀檔
+    pd.DataFrame({"video_id": ["other"], "cluster_n": [0], "cluster_keywords": ["theirs"]}).to_csv(
+        "cluster_keywords.csv", index=False
+    )
+    assert artifacts.migrate_legacy(video) == []
+    assert artifacts.snapshot(video)["legacy_checked"]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("不應再取得影片鎖")
+
+    monkeypatch.setattr(artifacts, "video_lock", fail)
+    assert artifacts.migrate_legacy(video) == []
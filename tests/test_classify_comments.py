@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+import benchmark
+import classify_comments
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    df = benchmark.make_corpus(300)
+    # 邊界情況：空字串、純標點、問號
+    extra = pd.DataFrame({"text": ["", "！！！", "為什麼?"]})
+    return pd.concat([df[["text"]], extra], ignore_index=True)
+
+
+@pytest.mark.parametrize("pos_th, neg_th", [(2, -2), (1, -1), (3, 0)])
+def test_classify_frame_matches_loop_scorer(corpus, pos_th, neg_th):
+    expected = pd.DataFrame([classify_comments.classify_text(t, pos_th, neg_th) for t in corpus["text"]])
+    result = classify_comments.classify_frame(corpus.copy(), pos_th, neg_th)
+
+    assert result["sentiment_score"].tolist() == expected["sentiment_score"].tolist()
+    assert result["sentiment"].tolist() == expected["sentiment"].tolist()
+    assert result["is_question"].tolist() == expected["is_question"].tolist()
+
+
+def test_token_matrix_round_trip(tmp_path, corpus):
+    texts = corpus["text"].tolist()
+    matrix, vocab = classify_comments.build_token_matrix([classify_comments.jieba.lcut(t) for t in texts])
+    digest = classify_comments.texts_hash(texts)
+    path = str(tmp_path / "tokens.npz")
+    classify_comments.save_token_matrix(path, matrix, vocab, digest)
+
+    loaded_matrix, loaded_vocab = classify_comments.load_token_matrix(path, digest)
+    assert loaded_vocab == vocab
+    assert (loaded_matrix != matrix).nnz == 0
+    assert classify_comments.load_token_matrix(path, "other digest") is None
+
+
+def test_chunked_mode_matches_in_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    df = benchmark.make_corpus(250)
+    results = {}
+    for video_id, chunksize, workers in [("memory", None, 1), ("chunked", 64, 1), ("parallel", 64, 2)]:
+        path = classify_comments.comment_store.comments_path(video_id)
+        classify_comments.artifacts.write_csv(df, path)
+        classify_comments.main(video_id, chunksize=chunksize, workers=workers)
+        results[video_id] = pd.read_csv(path)
+
+    columns = ["comment_id", "sentiment_score", "sentiment", "is_question"]
+    pd.testing.assert_frame_equal(results["chunked"][columns], results["memory"][columns])
+    pd.testing.assert_frame_equal(results["parallel"][columns], results["memory"][columns])
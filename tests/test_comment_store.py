@@ -0,0 +1,50 @@
+import os
+
+import pandas as pd
+
+import artifacts
+import benchmark
+import comment_store
+
+
+def _write(df, target):
+    artifacts.write_csv(df, target)
+    return target
+
+
+def test_offloaded_text_matches_in_memory(video):
+    path = _write(benchmark.make_corpus(300), comment_store.comments_path(video))
+    full = comment_store.load_comments(path)
+    df, store = comment_store.load_comments_offloaded(path)
+
+    assert "text" not in df.columns
+    assert len(store) == len(df) == len(full)
+    subset = df[df["is_reply"]].sort_values("likeCount").head(40)
+    restored = comment_store.with_text(subset, store)
+    expected = full.set_index("comment_id").loc[restored["comment_id"], "text"].tolist()
+    assert restored["text"].tolist() == expected
+
+
+def test_with_text_handles_unmatched_rows_and_plain_frames(video):
+    path = _write(pd.DataFrame({"comment_id": ["a", "b"], "text": ["你好", ""]}), comment_store.comments_path(video))
+    df, store = comment_store.load_comments_offloaded(path)
+    merged = pd.DataFrame({"comment_id": ["b", "zz"]}).merge(df, on="comment_id", how="left")
+    texts = comment_store.with_text(merged, store)["text"]
+    assert texts.iloc[0] == ""
+    assert pd.isna(texts.iloc[1])
+
+    plain = comment_store.load_comments(path)
+    assert comment_store.with_text(plain, None) is plain
+
+
+def test_text_store_is_rebuilt_and_pruned_with_versions(video):
+    path = comment_store.comments_path(video)
+    for i in range(artifacts.KEEP_VERSIONS + 2):
+        _write(pd.DataFrame({"comment_id": ["a"], "text": [f"第 {i} 版"]}), path)
+        artifacts.record(video, path)
+        snapshot_file = artifacts.resolve(video, artifacts.snapshot(video), "comments.csv")
+        _, store = comment_store.load_comments_offloaded(snapshot_file)
+        assert store[0] == f"第 {i} 版"
+
+    text_files = [f for f in os.listdir(artifacts.video_dir(video)) if ".text." in f]
+    assert len(text_files) == 2 * artifacts.KEEP_VERSIONS
@@ -0,0 +1,104 @@
+import os
+import time
+
+import pytest
+
+import job_runner
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    started = []
+    monkeypatch.setattr(job_runner, "_start_worker", started.append)
+    return started
+
+
+def _write_job(video_id, **fields):
+    os.makedirs(job_runner.JOBS_DIR, exist_ok=True)
+    job = job_runner._new_job(video_id)
+    job.update(fields)
+    job_runner._write_json(job_runner.job_path(video_id), job)
+    return job
+
+
+def _heartbeat(worker_id, age=0):
+    os.makedirs(job_runner.WORKERS_DIR, exist_ok=True)
+    path = job_runner._worker_file(worker_id)
+    with open(path, "w") as f:
+        f.write("1")
+    if age:
+        past = time.time() - age
+        os.utime(path, (past, past))
+
+
+def test_claim_takes_oldest_queued_job(queue):
+    _write_job("b", submitted_at=2)
+    _write_job("a", submitted_at=1)
+
+    job = job_runner._claim_next_job("w1")
+
+    assert job["video_id"] == "a"
+    stored = job_runner.read_job("a")
+    assert stored["status"] == "running"
+    assert stored["worker"] == "w1"
+    assert stored["attempts"] == 1
+    assert job_runner.read_job("b")["status"] == "queued"
+
+
+def test_claim_requeues_job_of_dead_worker(queue):
+    _heartbeat("dead", age=job_runner.HEARTBEAT_TIMEOUT + 5)
+    _write_job("a", status="running", worker="dead", attempts=1)
+
+    job = job_runner._claim_next_job("w2")
+
+    assert job["video_id"] == "a"
+    assert job["worker"] == "w2"
+    assert job["attempts"] == 2
+
+
+def test_claim_leaves_live_worker_job_alone(queue):
+    _heartbeat("live")
+    _write_job("a", status="running", worker="live", attempts=1)
+
+    assert job_runner._claim_next_job("w2") is None
+    assert job_runner.read_job("a")["worker"] == "live"
+
+
+def test_poll_requeues_stale_job_and_starts_worker(queue):
+    _write_job("a", status="running", worker="gone", attempts=1)
+
+    job = job_runner.poll_job("a")
+
+    assert job["status"] == "queued"
+    assert len(queue) == 1
+
+
+def test_poll_fails_job_after_max_attempts(queue):
+    _write_job("a", status="running", worker="gone", attempts=job_runner.MAX_ATTEMPTS)
+
+    job = job_runner.poll_job("a")
+
+    assert job["status"] == "error"
+    assert job["error_type"] == "WorkerLost"
+    assert queue == []
+
+
+def test_ensure_workers_counts_starting_workers(queue):
+    for i in range(job_runner.MAX_WORKERS + 2):
+        _write_job(f"v{i}")
+
+    # 新 worker 還沒開始心跳之前，重複呼叫也不會超過上限
+    job_runner.ensure_workers()
+    job_runner.ensure_workers()
+
+    assert len(queue) == job_runner.MAX_WORKERS
+    assert len(job_runner._live_workers()) == job_runner.MAX_WORKERS
+
+
+def test_submit_dedupes_active_job(queue):
+    first = job_runner.submit_job("a")
+    second = job_runner.submit_job("a")
+
+    assert first["submitted_at"] == second["submitted_at"]
+    assert len(queue) == 1
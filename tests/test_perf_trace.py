@@ -0,0 +1,44 @@
+import os
+import time
+
+import numpy as np
+
+import perf_trace
+
+
+def test_span_peak_is_per_span(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with perf_trace.run("pipeline", video_id="vid") as run:
+        with perf_trace.span("big"):
+            block = np.ones(20_000_000)
+            time.sleep(0.2)
+            del block
+        with perf_trace.span("small"):
+            time.sleep(0.1)
+
+    spans = {s["name"]: s for s in run.spans}
+    if spans["big"]["peak_rss_mb"] is None:
+        return  # 這個平台無法取得 RSS
+    # 後面的 span 不應該沿用前一個 span 的峰值
+    assert spans["big"]["peak_rss_mb"] - spans["small"]["peak_rss_mb"] > 100
+    assert spans["small"]["rss_delta_mb"] is not None
+
+
+def test_traces_are_namespaced_by_run_name(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ["pipeline", "gemini"]:
+        with perf_trace.run(name, video_id="a_b"):
+            pass
+    with perf_trace.run("pipeline", video_id="a"):
+        pass
+
+    assert [os.path.basename(p).split("_")[0] for p in perf_trace.list_traces("a_b")] == ["pipeline"]
+    assert len(perf_trace.list_traces("a_b", "gemini")) == 1
+    # 其他影片 ID 的前綴不應該被算進來
+    assert len(perf_trace.list_traces("a")) == 1
+
+
+def test_recording_outside_run_is_noop():
+    with perf_trace.span("idle") as record:
+        record["items"] = 1
+    perf_trace.count("x")
@@ -0,0 +1,56 @@
+import os
+
+import pandas as pd
+
+import artifacts
+import benchmark
+import comment_store
+import pipeline
+
+VIDEO = "vid"
+STAGES = ["classify", "rollup"]
+
+
+def _write_comments(df):
+    artifacts.write_csv(df, comment_store.comments_path(VIDEO))
+    artifacts.record(VIDEO, comment_store.comments_path(VIDEO))
+
+
+def _classified():
+    return pd.read_csv(comment_store.comments_path(VIDEO))[["comment_id"] + pipeline.CLASSIFY_COLUMNS]
+
+
+def test_second_run_reuses_cached_stages(video):
+    _write_comments(benchmark.make_corpus(200))
+    first = pipeline.run_pipeline(VIDEO, stages=STAGES)
+    assert first["report"] == {"classify": "ran", "rollup": "ran"}
+    before = _classified()
+
+    second = pipeline.run_pipeline(VIDEO, stages=STAGES)
+    assert second["report"] == {"classify": "reused", "rollup": "reused"}
+    pd.testing.assert_frame_equal(_classified(), before)
+
+    forced = pipeline.run_pipeline(VIDEO, stages=STAGES, force=True)
+    assert forced["report"]["classify"] == "ran"
+
+
+def test_changed_comments_change_the_fingerprint(video):
+    df = benchmark.make_corpus(50)
+    _write_comments(df)
+    first = pipeline.comment_data_hash(VIDEO)
+
+    df.loc[0, "text"] = "改寫過的留言"
+    _write_comments(df)
+    assert pipeline.comment_data_hash(VIDEO) != first
+
+
+def test_stage_cache_keeps_recent_fingerprints(video, monkeypatch):
+    monkeypatch.setattr(pipeline, "HASH_CHUNKSIZE", 7)
+    _write_comments(benchmark.make_corpus(30))
+    fingerprints = [
+        pipeline.run_classify(VIDEO, params={"pos_th": pos_th})["fingerprint"]
+        for pos_th in range(1, pipeline.CACHE_KEEP + 3)
+    ]
+    cache_dir = artifacts.path(VIDEO, pipeline.CACHE_DIR)
+    kept = {name[len("classify_"):-len(".csv")] for name in os.listdir(cache_dir)}
+    assert kept == set(fingerprints[-pipeline.CACHE_KEEP:])
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+import rollups
+
+
+def _comments(n=50, start="2024-01-01"):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "comment_id": [f"c{i}" for i in range(n)],
+        "publishedAt": pd.Timestamp(start, tz="UTC") + pd.to_timedelta(rng.integers(0, 24 * 30, n), unit="h"),
+        "sentiment": rng.choice(rollups.SENTIMENTS, n),
+        "cluster": rng.integers(0, 3, n),
+        "is_question": rng.random(n) < 0.3,
+    })
+
+
+def _hourly(r):
+    return r.hourly.sort_index().astype(np.int64).rename(None)
+
+
+def test_save_load_round_trip(video):
+    r = rollups.Rollups.build(_comments())
+    path = rollups.rollup_path(video)
+    r.save(path)
+
+    loaded = rollups.Rollups.load(path)
+    pd.testing.assert_series_equal(_hourly(loaded), _hourly(r))
+    assert loaded.ledger["comment_id"].tolist() == r.ledger["comment_id"].tolist()
+    for granularity in ["day", "week"]:
+        expected = r.table(granularity)
+        got = rollups.load_table(video, granularity)
+        assert got["count"].sum() == expected["count"].sum() == 50
+        assert got["bucket"].tolist() == expected["bucket"].tolist()
+
+
+def test_second_run_updates_saved_rollups(video):
+    df = _comments()
+    assert rollups.build_or_update(video, df) == 50
+
+    df.loc[0, "sentiment"] = "positive" if df.loc[0, "sentiment"] != "positive" else "negative"
+    df = pd.concat([df.iloc[1:], _comments(5, start="2025-01-01").assign(
+        comment_id=[f"n{i}" for i in range(5)])], ignore_index=True)
+    df = pd.concat([df, _comments(1).iloc[:1].assign(comment_id="c0", sentiment="neutral")], ignore_index=True)
+
+    assert rollups.build_or_update(video, df) > 0
+    updated = rollups.Rollups.load(rollups.rollup_path(video))
+    pd.testing.assert_series_equal(_hourly(updated), _hourly(rollups.Rollups.build(df)))
+
+
+def test_update_matches_full_rebuild():
+    df = _comments()
+    r = rollups.Rollups.build(df)
+    edited = df.drop(index=[3, 4]).copy()
+    edited.loc[5, "cluster"] = 2 if edited.loc[5, "cluster"] != 2 else 0
+
+    assert r.update(edited) == 3
+    pd.testing.assert_series_equal(_hourly(r), _hourly(rollups.Rollups.build(edited)))
+
+
+def test_missing_published_at_is_skipped(video):
+    df = _comments(10)
+    df["publishedAt"] = df["publishedAt"].astype(object)
+    df.loc[2, "publishedAt"] = pd.NaT
+    df.loc[3, "publishedAt"] = "not a date"
+
+    r = rollups.Rollups.build(df)
+    assert r.hourly.sum() == 8
+    assert r.ledger["hour"].dtype == np.int64
+    r.save(rollups.rollup_path(video))
+    assert rollups.load_table(video, "hour")["count"].sum() == 8
@@ -0,0 +1,70 @@
+import pytest
+
+import search_index
+
+COMMENTS = {
+    "a": "電池續航很好",
+    "b": "充電速度太慢了",
+    "c": "螢幕很漂亮，電池普通",
+    "d": "Battery life OR charging?",
+}
+
+
+def _build(comments=COMMENTS):
+    index = search_index.SearchIndex()
+    index.sync(list(comments), list(comments.values()))
+    return index
+
+
+def _brute_force(comments, term):
+    return {cid for cid, text in comments.items() if term.lower() in text.lower()}
+
+
+@pytest.mark.parametrize("term", ["電池", "電", "慢", "好", "池普", "battery", "b", "？"])
+def test_term_matches_substring_scan(term):
+    assert _build().search(term) == _brute_force(COMMENTS, term)
+
+
+def test_boolean_operators_are_case_insensitive():
+    index = _build()
+    for query in ["螢幕 OR 充電", "螢幕 or 充電", "螢幕 Or 充電", "螢幕 | 充電"]:
+        assert index.search(query) == {"b", "c"}
+    assert index.search("電池 and 普通") == {"c"}
+
+
+def test_sync_matches_full_rebuild():
+    index = _build()
+    updated = dict(COMMENTS)
+    del updated["b"]
+    updated["c"] = "螢幕很暗"
+    updated["e"] = "電池會發熱"
+
+    assert index.sync(list(updated), list(updated.values())) == 3
+    fresh = _build(updated)
+    assert len(index) == len(fresh) == 4
+    for term in ["電池", "充電", "漂亮", "暗", "電"]:
+        assert index.search(term) == fresh.search(term) == _brute_force(updated, term)
+    assert index.search("螢幕 OR 發熱") == {"c", "e"}
+
+
+def test_sync_without_changes_is_noop():
+    index = _build()
+    assert index.sync(list(COMMENTS), list(COMMENTS.values())) == 0
+
+
+def test_sync_compacts_after_many_deletions():
+    index = _build()
+    assert index.sync(["a"], [COMMENTS["a"]]) == 3
+    assert index.dead == 0
+    assert index.comment_ids == ["a"]
+    assert index.search("電") == {"a"}
+
+
+def test_save_load_round_trip(video):
+    index = _build()
+    path = search_index.index_path(video)
+    index.save(path)
+    loaded = search_index.SearchIndex.load(path)
+    assert len(loaded) == len(index)
+    for query in ["電池", "電", "battery OR 慢"]:
+        assert loaded.search(query) == index.search(query)
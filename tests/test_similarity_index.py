@@ -0,0 +1,50 @@
+import numpy as np
+
+import benchmark
+import similarity_index
+
+
+def _ids(n):
+    return [f"c{i}" for i in range(n)]
+
+
+def test_save_load_round_trip(video):
+    vectors = benchmark.make_vectors(200, dim=16)
+    similarity_index.save_embeddings(video, _ids(200), vectors, "stub")
+
+    index = similarity_index.NearestNeighborIndex.load(video)
+    assert index.model_name == "stub"
+    assert index.comment_ids == _ids(200)
+    assert index.ivf is None
+    np.testing.assert_array_equal(np.asarray(index.vectors), vectors)
+
+
+def test_exact_search_matches_brute_force():
+    vectors = benchmark.make_vectors(500, dim=16)
+    index = similarity_index.NearestNeighborIndex(vectors, _ids(500), "stub")
+
+    results = index.similar_to("c7", top_k=5)
+    scores = vectors @ vectors[7]
+    scores[7] = -np.inf
+    assert [cid for cid, _ in results] == [f"c{i}" for i in np.argsort(-scores)[:5]]
+
+
+def test_ivf_round_trip_and_recall(video, monkeypatch):
+    monkeypatch.setattr(similarity_index, "EXACT_LIMIT", 1_000)
+    vectors = benchmark.make_vectors(3_000, dim=16, topics=50)
+    similarity_index.save_embeddings(video, _ids(3_000), vectors, "stub")
+
+    index = similarity_index.NearestNeighborIndex.load(video)
+    assert index.ivf is not None
+    exact = similarity_index.NearestNeighborIndex(vectors, _ids(3_000), "stub")
+    recall = np.mean([
+        len({c for c, _ in index.similar_to(cid, 10)} & {c for c, _ in exact.similar_to(cid, 10)}) / 10
+        for cid in _ids(3_000)[:50]
+    ])
+    assert recall > 0.9
+
+
+def test_comment_without_vector_has_no_neighbours():
+    index = similarity_index.NearestNeighborIndex(benchmark.make_vectors(10, dim=8), _ids(10), "stub")
+    assert "short" not in index.row_of
+    assert index.similar_to("short") == []
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+import thread_index
+
+
+def _comments():
+    base = pd.Timestamp("2024-01-01", tz="UTC")
+    rows = []
+    for t in range(6):
+        top = f"t{t}"
+        rows.append((top, top, False, t, "positive", False, base + pd.Timedelta(hours=t)))
+        for r in range(t):
+            rows.append((f"{top}r{r}", top, True, r, ["neutral", "negative"][r % 2], r == 0,
+                         base + pd.Timedelta(hours=t, minutes=r + 1)))
+    return pd.DataFrame(rows, columns=[
+        "comment_id", "parent_comment_id", "is_reply", "likeCount", "sentiment", "is_question", "publishedAt",
+    ])
+
+
+def _assert_same(a, b):
+    assert a.thread_ids.tolist() == b.thread_ids.tolist()
+    assert a.member_ids.tolist() == b.member_ids.tolist()
+    np.testing.assert_array_equal(a.offsets, b.offsets)
+    pd.testing.assert_frame_equal(a.aggregates, b.aggregates, check_dtype=False)
+
+
+def test_save_load_round_trip(video):
+    index = thread_index.ThreadIndex.build(_comments())
+    path = thread_index.index_path(video)
+    index.save(path)
+    _assert_same(thread_index.ThreadIndex.load(path), index)
+    assert index.members("t2") == ["t2", "t2r0", "t2r1"]
+
+
+def test_update_matches_full_rebuild():
+    df = _comments()
+    index = thread_index.ThreadIndex.build(df)
+
+    df = df[df["comment_id"] != "t3r1"].copy()
+    df.loc[df["comment_id"] == "t4r0", "likeCount"] = 100
+    new_reply = df[df["comment_id"] == "t1r0"].assign(comment_id="t1r9", sentiment="negative")
+    df = pd.concat([df, new_reply], ignore_index=True)
+
+    updated, changed = index.update(df)
+    assert changed == 3
+    _assert_same(updated, thread_index.ThreadIndex.build(df))
+
+
+def test_update_without_changes_is_noop():
+    df = _comments()
+    index = thread_index.ThreadIndex.build(df)
+    assert index.update(df) == (index, 0)
+
+
+def test_missing_published_at_round_trips_as_nat(video):
+    df = _comments()
+    df["publishedAt"] = df["publishedAt"].where(df["parent_comment_id"] != "t0")
+    index = thread_index.ThreadIndex.build(df)
+    path = thread_index.index_path(video)
+    index.save(path)
+
+    loaded = thread_index.ThreadIndex.load(path)
+    assert pd.isna(loaded.aggregates.loc["t0", "first_activity"])
+    assert pd.notna(loaded.aggregates.loc["t1", "last_activity"])
@@ -0,0 +1,215 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import artifacts
+import perf_trace
+
+# ========= 1. 設定 =========
+SENTIMENTS = ["positive", "neutral", "negative"]
+
+# 這些欄位有變動時，該討論串的彙總需要重算（新回覆、按讚數、重新分類）
+HASH_COLUMNS = ["parent_comment_id", "likeCount", "sentiment", "is_question", "publishedAt"]
+
+AGG_COLUMNS = [
+    "reply_count", "total_likes", "positive", "neutral", "negative",
+    "question_count", "first_activity", "last_activity",
+]
+
+
+def index_path(video_id):
+    return artifacts.path(video_id, "threads.npz")
+
+
+def _row_hashes(df):
+    columns = [c for c in HASH_COLUMNS if c in df.columns]
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+def aggregate_threads(df):
+    """
+    以 parent_comment_id 彙總討論串：回覆數、總按讚、情緒分布、問題數、最早/最後活動時間
+    """
+    parent = df["parent_comment_id"].astype(str)
+    grouped = df.groupby(parent, sort=False)
+
+    agg = pd.DataFrame({
+        "reply_count": grouped["is_reply"].sum().astype(np.int32),
+        "total_likes": grouped["likeCount"].sum().astype(np.int64),
+        "first_activity": grouped["publishedAt"].min(),
+        "last_activity": grouped["publishedAt"].max(),
+    })
+
+    if "sentiment" in df.columns:
+        mix = df.groupby([parent, df["sentiment"].astype(str)]).size().unstack(fill_value=0)
+        agg = agg.join(mix.reindex(columns=SENTIMENTS, fill_value=0).astype(np.int32))
+    else:
+        for s in SENTIMENTS:
+            agg[s] = 0
+
+    if "is_question" in df.columns:
+        agg["question_count"] = grouped["is_question"].sum().astype(np.int32)
+    else:
+        agg["question_count"] = 0
+
+    agg.index.name = "thread_id"
+    return agg[AGG_COLUMNS]
+
+
+# ========= 2. 討論串索引 =========
+class ThreadIndex:
+    """
+    CSR 式的緊湊排列：第 i 個討論串的留言為 member_ids[offsets[i]:offsets[i+1]]，
+    第一則是頂層留言，其後為依時間排序的回覆
+    """
+
+    def __init__(self, thread_ids, offsets, member_ids, member_hashes, aggregates):
+        self.thread_ids = thread_ids
+        self.offsets = offsets
+        self.member_ids = member_ids
+        self.member_hashes = member_hashes
+        self.aggregates = aggregates
+        self.position = {tid: i for i, tid in enumerate(thread_ids.tolist())}
+
+    def __len__(self):
+        return len(self.thread_ids)
+
+    def members(self, thread_id):
+        i = self.position.get(thread_id)
+        if i is None:
+            return []
+        return self.member_ids[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def hot_threads(self, sort_by="reply_count", top_n=20, ascending=False):
+        return self.aggregates.sort_values(sort_by, ascending=ascending).head(top_n)
+
+    # ========= 3. 建立 / 增量更新 =========
+    @staticmethod
+    def _layout(df):
+        # 依 (討論串, 是否為回覆, 時間) 排序，同一串的留言連續存放
+        parent = df["parent_comment_id"].astype(str).to_numpy()
+        published = df["publishedAt"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        order = np.lexsort((published, df["is_reply"].to_numpy(), parent))
+
+        sorted_parent = parent[order]
+        thread_ids, starts = np.unique(sorted_parent, return_index=True)
+        offsets = np.append(starts, len(order)).astype(np.int64)
+        member_ids = df["comment_id"].astype(str).to_numpy()[order]
+        return thread_ids.astype(str), offsets, member_ids.astype(str), order
+
+    @classmethod
+    def build(cls, df):
+        thread_ids, offsets, member_ids, order = cls._layout(df)
+        hashes = _row_hashes(df)[order]
+        aggregates = aggregate_threads(df).reindex(thread_ids)
+        return cls(thread_ids, offsets, member_ids, hashes, aggregates)
+
+    def update(self, df):
+        """
+        只重算有新增、刪除或內容變動留言的討論串彙總
+
+        回傳:
+            (新的 ThreadIndex, 重算的討論串數)
+        """
+        thread_ids, offsets, member_ids, order = self._layout(df)
+        hashes = _row_hashes(df)[order]
+
+        old = pd.DataFrame({"comment_id": self.member_ids, "old_hash": self.member_hashes})
+        new = pd.DataFrame({"comment_id": member_ids, "hash": hashes})
+        both = new.merge(old, on="comment_id", how="inner")
+
+        changed_ids = pd.concat([
+            both.loc[both["hash"] != both["old_hash"], "comment_id"],
+            new.loc[~new["comment_id"].isin(old["comment_id"]), "comment_id"],   # 新留言
+            old.loc[~old["comment_id"].isin(new["comment_id"]), "comment_id"],   # 被刪除的留言
+        ]).unique()
+        if len(changed_ids) == 0:
+            return self, 0
+
+        # 變動留言所屬的討論串（新資料與舊索引都要看，涵蓋被刪除的留言）
+        def thread_lookup(ids, t_ids, t_offsets):
+            s = pd.Series(np.repeat(t_ids, np.diff(t_offsets)), index=ids)
+            return s[~s.index.duplicated()]
+
+        thread_of_new = thread_lookup(member_ids, thread_ids, offsets)
+        thread_of_old = thread_lookup(self.member_ids, self.thread_ids, self.offsets)
+        affected = set(thread_of_new.reindex(changed_ids).dropna()) | set(thread_of_old.reindex(changed_ids).dropna())
+
+        parent = df["parent_comment_id"].astype(str)
+        recomputed = aggregate_threads(df[parent.isin(affected)])
+        kept = self.aggregates.drop(index=list(affected), errors="ignore")
+        aggregates = pd.concat([kept, recomputed]).reindex(thread_ids)
+
+        return ThreadIndex(thread_ids, offsets, member_ids, hashes, aggregates), len(affected)
+
+    # ========= 4. 儲存 / 載入 =========
+    def save(self, path):
+        agg = self.aggregates
+        with artifacts.atomic_write(path) as tmp_path:
+            np.savez(
+                tmp_path,
+                thread_ids=self.thread_ids,
+                offsets=self.offsets,
+                member_ids=self.member_ids,
+                member_hashes=self.member_hashes,
+                **{
+                    f"agg_{col}": (
+                        agg[col].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+                        if col.endswith("_activity") else agg[col].to_numpy()
+                    )
+                    for col in AGG_COLUMNS
+                }
+            )
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as f:
+            thread_ids = f["thread_ids"]
+            aggregates = pd.DataFrame(
+                {
+                    col: (
+                        pd.to_datetime(f[f"agg_{col}"], utc=True)
+                        if col.endswith("_activity") else f[f"agg_{col}"]
+                    )
+                    for col in AGG_COLUMNS
+                },
+                index=pd.Index(thread_ids, name="thread_id")
+            )
+            return cls(thread_ids, f["offsets"], f["member_ids"], f["member_hashes"], aggregates)
+
+
+def build_or_update(video_id, df, save=True):
+    """
+    載入影片的討論串索引並增量更新，有變動才寫回檔案
+
+    參數:
+        save: False 時只在記憶體更新（沒有取得影片鎖時使用）
+    """
+    path = index_path(video_id)
+    index = ThreadIndex.load(path)
+
+    with perf_trace.span("thread_index.update", items=len(df)) as record:
+        if index is None:
+            index = ThreadIndex.build(df)
+            changed = len(index)
+        else:
+            index, changed = index.update(df)
+        record["threads_recomputed"] = changed
+
+    if changed and save:
+        index.save(path)
+        artifacts.record(video_id, path, threads=len(index))
+        print(f"✅ 討論串索引更新 {changed} 串（共 {len(index)} 串）")
+    return index
+
+
+if __name__ == "__main__":
+    import comment_store
+
+    video_id = input("請輸入 YouTube 影片 ID：").strip()
+    df = comment_store.load_comments(comment_store.comments_path(video_id))
+    index = build_or_update(video_id, df)
+    print(index.hot_threads().to_string())